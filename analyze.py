@@ -2,22 +2,121 @@
 
 import argparse
 import os
+import shutil
 import sys
-import yaml
-from compare import Comparator, ComparisonResults, DiffType
-from build import build_snapshot, clone_repository
-from blame import CommitLinkFinder
+import tempfile
+import threading
+from compare import (
+    Comparator,
+    ComparisonResults,
+    DiffType,
+    FunctionTimings,
+    Journal,
+    Provenance,
+    DIFFKEMP_OUT_FILENAME,
+    JOURNAL_FILENAME,
+    PROVENANCE_FILENAME,
+    TIMINGS_FILENAME,
+)
+from build import (
+    build_snapshot,
+    clone_repository,
+    remove_build_dir,
+    write_function_list,
+)
+from buildcache import BuildCache
+from blame import BLAME_ENGINES, LOG_ENGINE, CommitCache, CommitLinkFinder
+from cache import (
+    LOCK_SUFFIX,
+    SnapshotCache,
+    get_diffkemp_version,
+    get_dir_size,
+    is_locked,
+    lock,
+    remove_lock_file,
+    remove_locked,
+    resolve_commit,
+    select_evicted,
+)
+from database import ResultsDatabase
+from instrument import PROFILE_FILENAME, profiler
+from scheduler import Scheduler
+from storage import (
+    RESULTS_FORMATS,
+    YAML_FORMAT,
+    dump_yaml,
+    find_results_file,
+    get_results_file,
+    load_yaml,
+)
 
 
-def parse_args():
-    """Prepare the parser of command-line arguments and parse them."""
-    parser = argparse.ArgumentParser(
-        description="Compare multiple versions of a C project using Diffkemp."
-    )
-    parser.add_argument(
-        "config",
-        help="path to the configuration file, see README.md for details",
-    )
+COMMIT_CACHE_FILENAME = "commit-cache.yml"
+SWEEP_DIRNAME = "sweep"
+
+# Graphs of the compared pairs of versions
+CONSECUTIVE = "consecutive"
+ALL_PAIRS = "all-pairs"
+STAR = "star"
+
+# Share of the disk quota from which the entries are scanned before builds
+QUOTA_RESCAN_RATIO = 0.9
+
+
+class QuotaUsage:
+    """
+    The total size of the entries counted into the disk quota found by the
+    last scan, and the used space of their file systems at that time.
+    """
+
+    def __init__(self):
+        self.total = None
+        self.used = None
+        # Builds of multiple projects may enforce the disk quota concurrently
+        self.lock = threading.Lock()
+
+
+quota_usage = QuotaUsage()
+
+
+def get_tag_pairs(config):
+    """
+    Return the pairs of tags to compare given by the pairs field of the
+    configuration: consecutive tags (default), all pairs of tags, each tag
+    with the baseline (star), or an explicit list of [old, new] pairs.
+    """
+    tags = config["tags"]
+    pairs = config.get("pairs", CONSECUTIVE)
+    if pairs == CONSECUTIVE:
+        return list(zip(tags, tags[1:]))
+    if pairs == ALL_PAIRS:
+        return [(old, new) for i, old in enumerate(tags) for new in tags[i + 1 :]]
+    if pairs == STAR:
+        baseline = config.get("baseline", tags[-1])
+        if baseline not in tags:
+            raise ValueError(f"Baseline {baseline} is not one of the tags")
+        position = tags.index(baseline)
+        return [(old, baseline) for old in tags[:position]] + [
+            (baseline, new) for new in tags[position + 1 :]
+        ]
+    if not isinstance(pairs, list):
+        raise ValueError(f"Unknown graph of compared pairs: {pairs}")
+    tag_pairs = []
+    for pair in pairs:
+        if len(pair) != 2 or pair[0] == pair[1] or not set(pair) <= set(tags):
+            raise ValueError(f"Invalid pair of tags: {pair}")
+        tag_pairs.append(tuple(pair))
+    return list(dict.fromkeys(tag_pairs))
+
+
+def get_chain(tags, old_tag, new_tag):
+    """Return the pairs of consecutive tags between the two tags."""
+    first, last = sorted([tags.index(old_tag), tags.index(new_tag)])
+    return list(zip(tags[first:last], tags[first + 1 : last + 1]))
+
+
+def add_options(parser):
+    """Add the options shared by the analysis of one and multiple projects."""
     parser.add_argument(
         "--output",
         default="results",
@@ -31,6 +130,23 @@ def parse_args():
         default="sources",
         help="path to the directory where project sources will be stored",
     )
+    parser.add_argument(
+        "--mirrors",
+        help="path to the directory of bare mirrors of the project repositories "
+        "shared by all runs, from which the sources are cloned",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="do not fetch from the project repositories, use the existing "
+        "mirrors or clones only",
+    )
+    parser.add_argument(
+        "--blobless",
+        action="store_true",
+        help="clone the repositories without file contents, which are fetched "
+        "on checkout instead (not used with --mirrors)",
+    )
     parser.add_argument(
         "--snapshots",
         default="snapshots",
@@ -41,10 +157,83 @@ def parse_args():
         default="builds",
         help="path to the directory where built projects will be stored",
     )
+    parser.add_argument(
+        "--snapshot-cache",
+        help="path to the directory where built snapshots are cached "
+        "(default: .cache in the snapshots directory)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        help="maximum size of the snapshot cache in GiB, least recently used "
+        "snapshots are evicted when it is exceeded",
+    )
+    parser.add_argument(
+        "--build-cache",
+        help="path to the directory where the results of the configuration "
+        "commands and the compiled sources are cached to be reused by builds "
+        "of other versions",
+    )
+    parser.add_argument(
+        "--keep-builds",
+        action="store_true",
+        help="keep the build directories after the snapshots are built",
+    )
+    parser.add_argument(
+        "--disk-quota",
+        type=float,
+        help="maximum total size in GiB of the cached snapshots, the build "
+        "directories and the build cache, least recently used ones are removed "
+        "when it is exceeded",
+    )
     parser.add_argument(
         "--rebuild",
         action="store_true",
-        help="rebuild all project versions even if the snapshots already exist",
+        help="rebuild all project versions even if the snapshots are cached",
+    )
+    parser.add_argument(
+        "--worktrees",
+        action="store_true",
+        help="check out each project version as a git worktree of the cloned "
+        "repository instead of copying the whole repository",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="maximum number of builds or comparisons to run concurrently",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="split the functions of each comparison among this many parallel "
+        "diffkemp invocations, balanced by the timings of previous runs",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse existing results and compare only the functions whose "
+        "results are missing or were computed using different settings",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="reuse the comparisons finished by a previous interrupted run",
+    )
+    parser.add_argument(
+        "--prune-unchanged",
+        action="store_true",
+        help="classify functions which do not depend on any file changed "
+        "between the versions as equal without comparing them, using the call "
+        "graphs of the snapshots",
+    )
+    parser.add_argument(
+        "--prune-outputs",
+        action="store_true",
+        help="remove the DiffKemp outputs of pairs of versions which are no "
+        "longer compared",
     )
     parser.add_argument(
         "--no-compare",
@@ -61,6 +250,14 @@ def parse_args():
         action="store_true",
         help="prepare a template for manual evaluation",
     )
+    parser.add_argument(
+        "--blame-engine",
+        choices=BLAME_ENGINES,
+        default=LOG_ENGINE,
+        help="method of finding the commits changing semantically different "
+        "functions for the review template: git log -L for each function "
+        "(log) or a single pass over the patches between the versions (hunks)",
+    )
     parser.add_argument(
         "--disable-patterns",
         help="comma-separated list of built-in patterns to disable",
@@ -68,124 +265,595 @@ def parse_args():
     parser.add_argument(
         "--custom-patterns", help="file with custom pattern configuration for Diffkemp"
     )
+    parser.add_argument(
+        "--results-format",
+        choices=RESULTS_FORMATS,
+        default=YAML_FORMAT,
+        help="format of the exported results: a YAML mapping (yaml) or one JSON "
+        "record per comparison (jsonl)",
+    )
+    parser.add_argument(
+        "--database",
+        help="SQLite database into which the results are imported after the "
+        "analysis, see results-db.py",
+    )
+    parser.add_argument(
+        "--pair-timeout",
+        type=float,
+        help="time limit in seconds of comparing a pair of versions at once, "
+        "the functions of a pair exceeding it are compared separately",
+    )
+    parser.add_argument(
+        "--function-timeout",
+        type=float,
+        help="time limit in seconds of comparing a single function, functions "
+        "exceeding it are classified as timeout (defaults to --pair-timeout)",
+    )
+    parser.add_argument(
+        "--memory",
+        type=float,
+        help="maximum total memory in GiB expected to be used by concurrently "
+        "running builds and comparisons",
+    )
+    parser.add_argument(
+        "--build-memory",
+        type=float,
+        default=0,
+        help="expected memory usage of a single build in GiB",
+    )
+    parser.add_argument(
+        "--compare-memory",
+        type=float,
+        default=0,
+        help="expected memory usage of a single comparison in GiB",
+    )
+
+
+def parse_args():
+    """Prepare the parser of command-line arguments and parse them."""
+    parser = argparse.ArgumentParser(
+        description="Compare multiple versions of a C project using Diffkemp."
+    )
+    parser.add_argument(
+        "config",
+        help="path to the configuration file, see README.md for details",
+    )
+    add_options(parser)
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
+class Analysis:
+    """
+    Class for analyzing a single project: building snapshots of its versions
+    and comparing them. Tasks of the analysis are named by tuples starting
+    with the project name, so that analyses of multiple projects can share a
+    single scheduler. Analyses of variants of a project (e.g., with different
+    patterns) share the builds of the project, but store their results in a
+    separate output directory and name their other tasks separately.
+    """
 
-    # Load the configuration file
-    with open(args.config, "r") as config_file:
-        config = yaml.safe_load(config_file)
+    def __init__(self, args, config, cache, source_dir=None, variant=None):
+        self.args = args
+        self.config = config
+        self.cache = cache
+        self.project_name = config["name"]
+        self.variant = variant
+        self.name = self.project_name
+        self.prefix = (self.project_name,)
+        self.tags = config["tags"]
+        self.tag_pairs = get_tag_pairs(config)
+        self.source_dir = source_dir or os.path.join(args.sources, self.project_name)
+        self.output_dir = os.path.join(args.output, self.project_name)
+        if variant is not None:
+            self.name = f"{self.project_name}/{variant}"
+            self.prefix = (self.project_name, SWEEP_DIRNAME, variant)
+            self.output_dir = os.path.join(self.output_dir, SWEEP_DIRNAME, variant)
+        self.snapshots_dir = os.path.join(args.snapshots, self.project_name)
+        self.results_file_path = get_results_file(
+            self.output_dir, args.results_format
+        )
+        # Results of a previous run may be stored in any of the formats
+        self.previous_results_path = find_results_file(
+            self.output_dir, args.results_format
+        )
+        self.provenance_file_path = os.path.join(self.output_dir, PROVENANCE_FILENAME)
+        self.timings_file_path = os.path.join(self.output_dir, TIMINGS_FILENAME)
+        self.journal = Journal(os.path.join(self.output_dir, JOURNAL_FILENAME))
+        self.results_exist = self.previous_results_path is not None
+        # Compare the snapshots unless the results already exist
+        self.compare = not args.no_compare and (
+            args.incremental or not self.results_exist
+        )
+        self.comparator = None
+        self.keys = []
 
-    project_name = config["name"]
-    tags = config["tags"]
-    source_dir = os.path.join(args.sources, project_name)
-    output_dir = os.path.join(args.output, project_name)
-    snapshots_dir = os.path.join(args.snapshots, project_name)
-    os.makedirs(snapshots_dir, exist_ok=True)
-
-    # If the source directory does not exist, clone the repository
-    if not os.path.isdir(source_dir):
-        clone_repository(args.verbose, config["git"], source_dir)
-
-    # Build all snapshots
-    for tag in tags:
-        build_dir = os.path.join(args.builds, project_name, tag)
-        snapshot_dir = os.path.join(snapshots_dir, tag)
-        if os.path.isdir(snapshot_dir) and not args.rebuild:
-            print(f"Skipping the build of {project_name} @ {tag}.")
-            continue
-        print(f"Building {project_name} @ {tag}.")
-        build_snapshot(
-            args.verbose,
-            args.diffkemp,
-            config,
-            tag,
-            source_dir,
-            build_dir,
-            snapshot_dir,
+    def task(self, *name):
+        """Construct the name of a task of this analysis."""
+        return (*self.prefix, *name)
+
+    def build_task(self, tag):
+        """Construct the name of the build task, shared by all variants."""
+        return (self.project_name, "build", tag)
+
+    def clone(self):
+        """Clone the repository or fetch the tags missing in the clone."""
+        with profiler.stage("clone", project=self.project_name):
+            clone_repository(
+                self.args.verbose,
+                self.config["git"],
+                self.source_dir,
+                self.tags,
+                mirrors_dir=self.args.mirrors,
+                offline=self.args.offline,
+                blobless=self.args.blobless,
+            )
+
+    def prepare(self):
+        """Prepare the output directories and the comparator."""
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not self.args.no_compare and not self.compare:
+            print(f"Skipping comparison of {self.name}, results already exist.")
+
+        commits = {tag: resolve_commit(self.source_dir, tag) for tag in self.tags}
+        self.comparator = Comparator(
+            self.args.verbose,
+            self.args.diffkemp,
+            self.config,
+            self.snapshots_dir,
+            self.output_dir,
+            self.args.custom_patterns,
+            self.args.disable_patterns,
+            diffkemp_version=self.cache.diffkemp_version,
+            commits=commits,
+            journal=self.journal,
+            name=self.name,
+            pair_timeout=self.args.pair_timeout,
+            function_timeout=self.args.function_timeout,
+            prune_source_dir=self.source_dir if self.args.prune_unchanged else None,
         )
+        if not self.compare:
+            return
+        previous_results = ComparisonResults()
+        provenance = Provenance()
+        if self.results_exist:
+            previous_results = ComparisonResults.load(self.previous_results_path)
+            provenance = Provenance.load(self.provenance_file_path)
+        # Finished comparisons of an interrupted run are stored in the journal
+        if self.args.resume:
+            replayed = self.journal.replay(previous_results, provenance)
+            print(
+                f"Resuming {self.name} with {replayed} finished comparisons."
+            )
+        else:
+            self.journal.clear()
+        self.comparator.load_previous(previous_results, provenance)
+        self.comparator.timings = FunctionTimings.load(self.timings_file_path)
 
-    # Create the output directory
-    output_dir = os.path.join(args.output, project_name)
-    os.makedirs(output_dir, exist_ok=True)
-    results_file_path = os.path.join(output_dir, "results.yml")
+    def schedule(self, scheduler, run_dir):
+        """
+        Schedule all builds and comparisons of the analysis. Each comparison
+        starts as soon as both of its snapshots are available.
+        """
+        # The list of functions is shared by all builds of this run
+        function_list_dir = os.path.join(run_dir, self.project_name)
+        os.makedirs(function_list_dir, exist_ok=True)
+        function_list_path = write_function_list(
+            self.config["functions"], function_list_dir
+        )
+        self.schedule_builds(scheduler, function_list_path)
+        if self.compare:
+            self.schedule_comparisons(scheduler)
 
-    # If the user does not want to compare the snapshots, exit
-    if args.no_compare:
-        return
+    def schedule_builds(self, scheduler, function_list_path):
+        """
+        Schedule the builds of all project versions whose snapshots are not
+        cached yet.
+        """
+        args = self.args
+        cache = self.cache
+        build_cache = None
+        if args.build_cache is not None:
+            build_cache = BuildCache(args.build_cache)
+
+        def build(tag, commit, key, snapshot_dir):
+            build_dir = os.path.join(args.builds, self.project_name, tag)
+            # The locks keep the quota of other builds from removing this one
+            with lock(build_dir), lock(cache.entry_dir(key)):
+                check_disk_quota(args, cache)
+                print(f"Building {self.project_name} @ {tag}.")
+                cache.prepare(key)
+                build_snapshot(
+                    args.verbose,
+                    args.diffkemp,
+                    self.config,
+                    tag,
+                    self.source_dir,
+                    build_dir,
+                    cache.snapshot_dir(key),
+                    function_list_path,
+                    worktree=args.worktrees,
+                    build_cache=build_cache,
+                )
+                with profiler.stage("store"):
+                    cache.store(key, self.project_name, tag, commit, self.config)
+                cache.link(key, snapshot_dir)
+                # The snapshot does not need the build directory
+                if not args.keep_builds:
+                    remove_build_dir(
+                        args.verbose,
+                        self.source_dir,
+                        build_dir,
+                        worktree=args.worktrees,
+                    )
+                    remove_lock_file(build_dir)
+
+        keys = {}
+        for tag in self.tags:
+            snapshot_dir = os.path.join(self.snapshots_dir, tag)
+            commit = self.comparator.commits[tag]
+            key = cache.key(commit, self.config)
+            if key in keys:
+                # Another tag points to the same commit, reuse its snapshot
+                scheduler.add(
+                    self.build_task(tag),
+                    f"reuse of the snapshot of {self.project_name} @ {keys[key]} "
+                    f"for {tag}",
+                    cache.link,
+                    key,
+                    snapshot_dir,
+                    dependencies=[self.build_task(keys[key])],
+                    priority=1,
+                )
+                continue
+            keys[key] = tag
+            if not args.rebuild and cache.lookup(key):
+                print(f"Skipping the build of {self.project_name} @ {tag}.")
+                cache.link(key, snapshot_dir)
+                continue
+            scheduler.add(
+                self.build_task(tag),
+                f"build of {self.project_name} @ {tag}",
+                profiler.wrap("build", build, project=self.project_name, tag=tag),
+                tag,
+                commit,
+                key,
+                snapshot_dir,
+                priority=1,
+                memory=args.build_memory,
+            )
+        self.keys = list(keys)
+
+    def schedule_comparisons(self, scheduler):
+        """
+        Schedule the comparisons of the pairs of project versions. Only the
+        functions without up-to-date previous results are compared. If
+        multiple shards are requested, the compared functions are split among
+        that many parallel diffkemp invocations whose results are merged
+        afterwards. Comparisons of distant versions wait for the comparisons
+        of consecutive versions in between, if these are compared too, so
+        that the functions equal in all of them are not compared.
+        """
+        comparator = self.comparator
+        shards = self.args.shards
+        for old_tag, new_tag in self.tag_pairs:
+            outdated = comparator.outdated_functions(old_tag, new_tag)
+            if not outdated:
+                print(f"Reusing the results of {old_tag} -> {new_tag}.")
+                comparator.reuse_results(old_tag, new_tag)
+                continue
+            description = (
+                f"comparison of {old_tag} and {new_tag} of {self.name}"
+            )
+            dependencies = [self.build_task(old_tag), self.build_task(new_tag)]
+            chain = get_chain(self.tags, old_tag, new_tag)
+            if len(chain) > 1 and all(pair in self.tag_pairs for pair in chain):
+                dependencies += [self.task("compare", *pair) for pair in chain]
+            labels = {"project": self.name, "old": old_tag, "new": new_tag}
+            if shards <= 1:
+                scheduler.add(
+                    self.task("compare", old_tag, new_tag),
+                    description,
+                    profiler.wrap("compare", comparator.compare_snapshots, **labels),
+                    old_tag,
+                    new_tag,
+                    outdated,
+                    dependencies=dependencies,
+                    memory=self.args.compare_memory,
+                    priority=-comparator.estimate(outdated),
+                )
+                continue
+            partition = comparator.partition(outdated, shards)
+            for index, functions in enumerate(partition):
+                scheduler.add(
+                    self.task("compare", old_tag, new_tag, index),
+                    f"shard {index + 1}/{len(partition)} of {description}",
+                    profiler.wrap(
+                        "compare-shard", comparator.compare_shard, shard=index, **labels
+                    ),
+                    old_tag,
+                    new_tag,
+                    index,
+                    functions,
+                    dependencies=dependencies,
+                    memory=self.args.compare_memory,
+                    priority=-comparator.estimate(functions),
+                )
+            scheduler.add(
+                self.task("compare", old_tag, new_tag),
+                f"merge of {description}",
+                profiler.wrap("merge-shards", comparator.merge_shards, **labels),
+                old_tag,
+                new_tag,
+                outdated,
+                dependencies=[
+                    self.task("compare", old_tag, new_tag, index)
+                    for index in range(len(partition))
+                ],
+            )
+
+    def finish(self, failed, skipped):
+        """
+        Export the results once all tasks of the analysis have finished.
+        Return 1 if some of the tasks failed or were skipped.
+        """
+        prefix_len = len(self.prefix)
+        failed = [name for name in failed if name[:prefix_len] == self.prefix]
+        skipped = [name for name in skipped if name[:prefix_len] == self.prefix]
+        if self.compare and self.comparator is not None:
+            self.comparator.timings.dump(self.timings_file_path)
+        if failed or skipped:
+            print(
+                f"Analysis of {self.name} did not finish: {len(failed)} "
+                f"tasks failed, {len(skipped)} tasks were skipped."
+            )
+            if self.compare:
+                print("Use --resume to reuse the finished comparisons.")
+            self.export_profile()
+            return 1
+
+        # If the user does not want to compare the snapshots, exit
+        if self.args.no_compare:
+            self.export_profile()
+            return 0
+
+        if self.compare:
+            results = self.comparator.get_results()
+            results.sort(self.tag_pairs)
+            self.comparator.provenance.dump(self.provenance_file_path)
+        else:
+            results = ComparisonResults.load(self.previous_results_path)
+
+        # Export the results
+        print(f"Exporting results to {self.results_file_path}.")
+        with profiler.stage("export", project=self.name):
+            results.dump(self.results_file_path)
+        if self.results_exist and self.previous_results_path != self.results_file_path:
+            os.remove(self.previous_results_path)
+        self.journal.clear()
+        if self.args.prune_outputs:
+            self.prune_outputs()
 
-    if os.path.exists(results_file_path):
-        print("Skipping comparison, results already exist.")
-        results = ComparisonResults.load(results_file_path)
-    else:
-        # Compare consecutive pairs of snapshots
-        comparator = Comparator(
-            args.verbose,
-            args.diffkemp,
-            config,
-            snapshots_dir,
-            output_dir,
-            args.custom_patterns,
-            args.disable_patterns,
+        # Export the statistics
+        stats_file_path = os.path.join(self.output_dir, "stats.yml")
+        print(f"Exporting statistics to {stats_file_path}.")
+        with open(stats_file_path, "w") as stats_file:
+            dump_yaml(results.get_stats(), stats_file)
+
+        if self.args.review_template:
+            self.export_review_templates(results)
+
+        if self.args.database:
+            print(f"Importing results of {self.name} to {self.args.database}.")
+            database = ResultsDatabase(self.args.database)
+            database.import_project(self.name, self.output_dir)
+            database.close()
+
+        self.export_profile()
+        return 0
+
+    def prune_outputs(self):
+        """Remove the DiffKemp outputs of pairs of tags no longer compared."""
+        compared = {f"{old_tag}-{new_tag}" for old_tag, new_tag in self.tag_pairs}
+        for entry in sorted(os.listdir(self.output_dir)):
+            out_dir = os.path.join(self.output_dir, entry)
+            if entry in compared or not os.path.isfile(
+                os.path.join(out_dir, DIFFKEMP_OUT_FILENAME)
+            ):
+                continue
+            print(f"Removing {out_dir}, {entry} is no longer compared.")
+            shutil.rmtree(out_dir)
+
+    def export_profile(self):
+        """
+        Export the time and resource usage of all stages and subprocesses of
+        the analysis, including the builds shared with other variants.
+        """
+        profile_file_path = os.path.join(self.output_dir, PROFILE_FILENAME)
+        print(f"Exporting profile to {profile_file_path}.")
+        profiler.dump(
+            self.output_dir, profiler.select(project={self.project_name, self.name})
         )
-        for old_tag, new_tag in zip(tags, tags[1:]):
-            comparator.compare_snapshots(old_tag, new_tag)
-        results = comparator.get_results()
-
-    # Export the results
-    print(f"Exporting results to {results_file_path}.")
-    with open(results_file_path, "w") as results_file:
-        yaml.safe_dump(results.results, results_file)
-
-    # Export the statistics
-    stats_file_path = os.path.join(output_dir, "stats.yml")
-    print(f"Exporting statistics to {stats_file_path}.")
-    with open(stats_file_path, "w") as stats_file:
-        yaml.safe_dump(results.get_stats(), stats_file)
-
-    if not args.review_template:
-        return
 
-    # Prepare templates for manual evaluation
-    template_semantic = {}
-    template_syntactic = {}
-
-    for old_tag, new_tag in zip(tags, tags[1:]):
-        key = ComparisonResults.key(old_tag, new_tag)
-        template_semantic[key] = {}
-        template_syntactic[key] = {}
-        diffkemp_out_dir = os.path.join(output_dir, f"{old_tag}-{new_tag}")
-        diffkemp_out_file = os.path.join(diffkemp_out_dir, "diffkemp-out.yaml")
-        with open(diffkemp_out_file, "r") as diffkemp_out:
-            diffkemp_out = yaml.safe_load(diffkemp_out)
-        commit_link_finder = CommitLinkFinder(
-            source_dir, old_tag, new_tag, diffkemp_out
+    def export_review_templates(self, results):
+        """Prepare templates for manual evaluation."""
+        template_semantic = {}
+        template_syntactic = {}
+        commit_cache = CommitCache(
+            os.path.join(self.output_dir, COMMIT_CACHE_FILENAME)
+        )
+
+        for old_tag, new_tag in self.tag_pairs:
+            key = ComparisonResults.key(old_tag, new_tag)
+            template_semantic[key] = {}
+            template_syntactic[key] = {}
+            diffkemp_out_dir = os.path.join(self.output_dir, f"{old_tag}-{new_tag}")
+            diffkemp_out_file = os.path.join(diffkemp_out_dir, "diffkemp-out.yaml")
+            # Pairs whose functions were all classified without DiffKemp may
+            # lack an output if they come from an older run
+            diffkemp_out = {"results": [], "definitions": {}}
+            if os.path.exists(diffkemp_out_file):
+                with open(diffkemp_out_file, "r") as out_file:
+                    diffkemp_out = load_yaml(out_file)
+            commit_link_finder = CommitLinkFinder(
+                self.source_dir,
+                old_tag,
+                new_tag,
+                diffkemp_out,
+                commit_cache,
+                self.args.jobs,
+                self.args.blame_engine,
+            )
+            tag_results = results.get(old_tag, new_tag)
+            with profiler.stage(
+                "blame", project=self.name, old=old_tag, new=new_tag
+            ):
+                commit_link_finder.prefetch(
+                    function
+                    for function, function_result in tag_results.items()
+                    if function_result == DiffType.SEMANTIC.value
+                )
+            for function, function_result in tag_results.items():
+                if function_result == DiffType.SEMANTIC.value:
+                    template_semantic[key][function] = {
+                        "category": "",
+                        "comment": "",
+                        "commits": commit_link_finder.get_commit_links(function),
+                    }
+                elif function_result == DiffType.SYNTACTIC.value:
+                    template_syntactic[key][function] = {
+                        "category": "",
+                        "comment": "",
+                    }
+        commit_cache.dump()
+
+        template_semantic_file_path = os.path.join(
+            self.output_dir, "template-semantic.yml"
         )
-        tag_results = results.get(old_tag, new_tag)
-        for function, function_result in tag_results.items():
-            if function_result == DiffType.SEMANTIC.value:
-                template_semantic[key][function] = {
-                    "category": "",
-                    "comment": "",
-                    "commits": commit_link_finder.get_commit_links(function),
-                }
-            elif function_result == DiffType.SYNTACTIC.value:
-                template_syntactic[key][function] = {
-                    "category": "",
-                    "comment": "",
-                }
-
-    template_semantic_file_path = os.path.join(output_dir, "template-semantic.yml")
-    print(f"Exporting semantic review template to {template_semantic_file_path}.")
-    with open(template_semantic_file_path, "w") as template_file:
-        yaml.safe_dump(template_semantic, template_file)
-
-    template_syntactic_file_path = os.path.join(output_dir, "template-syntactic.yml")
-    print(f"Exporting syntactic review template to {template_syntactic_file_path}.")
-    with open(template_syntactic_file_path, "w") as template_file:
-        yaml.safe_dump(template_syntactic, template_file)
+        print(f"Exporting semantic review template to {template_semantic_file_path}.")
+        with open(template_semantic_file_path, "w") as template_file:
+            dump_yaml(template_semantic, template_file)
+
+        template_syntactic_file_path = os.path.join(
+            self.output_dir, "template-syntactic.yml"
+        )
+        print(
+            f"Exporting syntactic review template to {template_syntactic_file_path}."
+        )
+        with open(template_syntactic_file_path, "w") as template_file:
+            dump_yaml(template_syntactic, template_file)
+
+
+def create_cache(args):
+    """Create the snapshot cache shared by all analyzed projects."""
+    return SnapshotCache(
+        args.snapshot_cache or os.path.join(args.snapshots, ".cache"),
+        get_diffkemp_version(args.diffkemp),
+        int(args.cache_size * 1024**3) if args.cache_size is not None else None,
+    )
+
+
+def get_used_space(args, cache):
+    """Return the used space of the file systems holding the quota entries."""
+    paths = {}
+    for path in [args.builds, cache.cache_dir, args.build_cache]:
+        if path is None:
+            continue
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        paths.setdefault(os.stat(path).st_dev, path)
+    return sum(shutil.disk_usage(path).used for path in paths.values())
+
+
+def check_disk_quota(args, cache):
+    """
+    Enforce the disk quota before a build if the entries may be close to it.
+    Scanning all entries is expensive, so the growth of the used space of
+    their file systems since the last scan is added to the total found by it
+    instead. This overestimates the growth of the entries unless other files
+    are removed meanwhile, which is made up for by the scan after the run.
+    """
+    if args.disk_quota is None:
+        return
+    with quota_usage.lock:
+        if quota_usage.total is not None:
+            growth = max(get_used_space(args, cache) - quota_usage.used, 0)
+            threshold = QUOTA_RESCAN_RATIO * args.disk_quota * 1024**3
+            if quota_usage.total + growth < threshold:
+                return
+        evict_over_quota(args, cache, ())
+
+
+def enforce_disk_quota(args, cache, keep=()):
+    """
+    Remove the least recently used cached snapshots, build directories and
+    entries of the build cache until they fit into the disk quota. Snapshots
+    with keys in keep or used by this run and the directories of builds
+    still running in this or another process are not removed, but they count
+    into the quota.
+    """
+    if args.disk_quota is None:
+        return
+    with quota_usage.lock:
+        evict_over_quota(args, cache, keep)
+
+
+def evict_over_quota(args, cache, keep):
+    """Remove the entries exceeding the disk quota, see enforce_disk_quota."""
+    entries = [
+        (last_used, size, cache.entry_dir(key))
+        for last_used, size, key in cache.entries()
+    ]
+    if os.path.isdir(args.builds):
+        for project in os.listdir(args.builds):
+            project_dir = os.path.join(args.builds, project)
+            for tag in os.listdir(project_dir):
+                if tag.endswith(LOCK_SUFFIX):
+                    continue
+                build_dir = os.path.join(project_dir, tag)
+                entries.append(
+                    (os.stat(build_dir).st_mtime, get_dir_size(build_dir), build_dir)
+                )
+    if args.build_cache is not None:
+        entries.extend(BuildCache(args.build_cache).entries())
+
+    keep = {cache.entry_dir(key) for key in set(keep) | cache.used}
+    keep |= {path for _, _, path in entries if is_locked(path)}
+    sizes = {path: size for _, size, path in entries}
+    total = sum(sizes.values())
+    for path in select_evicted(entries, int(args.disk_quota * 1024**3), keep):
+        with lock(path, wait=False) as acquired:
+            # A build may have started meanwhile
+            if not acquired or not os.path.lexists(path):
+                continue
+            print(f"Removing {path} to fit into the disk quota.")
+            # Worktrees of removed build directories are pruned by the next build
+            remove_locked(path)
+            total -= sizes[path]
+    quota_usage.total = total
+    quota_usage.used = get_used_space(args, cache)
+
+
+def main():
+    args = parse_args()
+
+    # Load the configuration file
+    with open(args.config, "r") as config_file:
+        config = load_yaml(config_file)
+
+    cache = create_cache(args)
+    analysis = Analysis(args, config, cache)
+    analysis.clone()
+    analysis.prepare()
+
+    scheduler = Scheduler(args.jobs, args.memory)
+    with tempfile.TemporaryDirectory(prefix="diffkemp-analysis-") as run_dir:
+        analysis.schedule(scheduler, run_dir)
+        failed, skipped = scheduler.run()
+    cache.evict(keep=analysis.keys)
+    enforce_disk_quota(args, cache, keep=analysis.keys)
+    return analysis.finish(failed, skipped)
 
 
 if __name__ == "__main__":
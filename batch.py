@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sys
+import tempfile
+from analyze import Analysis, add_options, create_cache, enforce_disk_quota
+from build import clone_repository
+from instrument import profiler
+from scheduler import Scheduler
+from storage import dump_yaml, load_yaml
+
+
+STATUS_FILENAME = "batch-status.yml"
+
+
+def parse_args():
+    """Prepare the parser of command-line arguments and parse them."""
+    parser = argparse.ArgumentParser(
+        description="Compare multiple versions of multiple C projects using "
+        "Diffkemp, sharing a single pool of jobs among all projects."
+    )
+    parser.add_argument(
+        "configs",
+        nargs="+",
+        help="paths to the configuration files, see README.md for details",
+    )
+    add_options(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    analyses = []
+    cache = create_cache(args)
+    # Projects sharing a repository share a single clone
+    source_dirs = {}
+    repo_tags = {}
+    for config_path in args.configs:
+        with open(config_path, "r") as config_file:
+            config = load_yaml(config_file)
+        source_dir = source_dirs.setdefault(
+            config["git"], os.path.join(args.sources, config["name"])
+        )
+        repo_tags.setdefault(config["git"], {}).update(dict.fromkeys(config["tags"]))
+        analyses.append(Analysis(args, config, cache, source_dir))
+
+    def clone(repo_url, source_dir):
+        with profiler.stage("clone", repo=repo_url):
+            clone_repository(
+                args.verbose,
+                repo_url,
+                source_dir,
+                list(repo_tags[repo_url]),
+                mirrors_dir=args.mirrors,
+                offline=args.offline,
+                blobless=args.blobless,
+            )
+
+    # Clone all repositories, then schedule the builds and comparisons of
+    # each project as soon as its repository is available
+    scheduler = Scheduler(args.jobs, args.memory)
+    with tempfile.TemporaryDirectory(prefix="diffkemp-analysis-") as run_dir:
+
+        def start(analysis):
+            analysis.prepare()
+            analysis.schedule(scheduler, run_dir)
+
+        for repo_url, source_dir in source_dirs.items():
+            scheduler.add(
+                ("clone", repo_url),
+                f"clone of {repo_url}",
+                clone,
+                repo_url,
+                source_dir,
+            )
+        for analysis in analyses:
+            scheduler.add(
+                analysis.task("prepare"),
+                f"preparation of {analysis.project_name}",
+                start,
+                analysis,
+                dependencies=[("clone", analysis.config["git"])],
+            )
+        failed, skipped = scheduler.run()
+    keys = [key for analysis in analyses for key in analysis.keys]
+    cache.evict(keep=keys)
+    enforce_disk_quota(args, cache, keep=keys)
+
+    # Finish all analyses and collect their status
+    status = {}
+    for analysis in analyses:
+        clone_task = ("clone", analysis.config["git"])
+        project_failed = [name for name in failed if name[0] == analysis.project_name]
+        if clone_task in failed:
+            project_failed.insert(0, clone_task)
+        project_skipped = [name for name in skipped if name[0] == analysis.project_name]
+        if analysis.comparator is not None:
+            finished = analysis.finish(failed, skipped) == 0
+        else:
+            finished = False
+        status[analysis.project_name] = {
+            "status": "finished" if finished else "failed",
+            "failed": [
+                f"{scheduler.tasks[name].description}: {failed[name]}"
+                for name in project_failed
+            ],
+            "skipped": [
+                scheduler.tasks[name].description for name in project_skipped
+            ],
+        }
+
+    os.makedirs(args.output, exist_ok=True)
+    status_file_path = os.path.join(args.output, STATUS_FILENAME)
+    print(f"Exporting status of all projects to {status_file_path}.")
+    with open(status_file_path, "w") as status_file:
+        dump_yaml(status, status_file)
+    # The profile of the whole batch includes the shared clones
+    profiler.dump(args.output, profiler.select())
+
+    for project_name, project_status in status.items():
+        print(
+            f"{project_name}: {project_status['status']} "
+            f"({len(project_status['failed'])} failed, "
+            f"{len(project_status['skipped'])} skipped)"
+        )
+    if any(project["status"] != "finished" for project in status.values()):
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from blame import HUNKS_ENGINE, LOG_ENGINE, CommitLinkFinder
+from columnar import ColumnarResults
+from compare import Comparator, ComparisonResults, DiffType
+from storage import load_yaml, write_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark performance-critical parts of the analysis."
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    classify_parser = subparsers.add_parser(
+        "classify",
+        help="classification of DiffKemp outputs with many functions",
+    )
+    classify_parser.add_argument(
+        "--sizes",
+        default="1000,5000,10000,20000",
+        help="comma-separated numbers of functions in the synthetic outputs",
+    )
+    classify_parser.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=5000,
+        help="largest size on which the original quadratic classification is run",
+    )
+
+    blame_parser = subparsers.add_parser(
+        "blame",
+        help="commit attribution using git log -L and using a pass over hunks",
+    )
+    blame_parser.add_argument("repo", help="path to the git repository")
+    blame_parser.add_argument("old_tag", help="the older compared tag")
+    blame_parser.add_argument("new_tag", help="the newer compared tag")
+    blame_parser.add_argument(
+        "diffkemp_out", help="path to diffkemp-out.yaml of the comparison"
+    )
+
+    results_parser = subparsers.add_parser(
+        "results",
+        help="memory usage and statistics of the dictionary and columnar results",
+    )
+    results_parser.add_argument(
+        "--functions",
+        type=int,
+        default=50000,
+        help="number of functions in each synthetic comparison",
+    )
+    results_parser.add_argument(
+        "--pairs",
+        type=int,
+        default=20,
+        help="number of synthetic comparisons",
+    )
+    return parser.parse_args()
+
+
+def synthesize_output(size, output_dir):
+    """
+    Create a synthetic DiffKemp output for the given number of functions with
+    all kinds of results equally represented.
+    """
+    functions = [f"function_{i}" for i in range(size)]
+    stdout_lines = []
+    diffkemp_out = {"results": [], "definitions": {}}
+    for i, function in enumerate(functions):
+        if i % 4 == 0:
+            stdout_lines.append(f"{function}: unknown")
+        elif i % 4 == 1:
+            diffkemp_out["results"].append(
+                {"function": function, "diffs": [{"function": function}]}
+            )
+        elif i % 4 == 2:
+            with open(os.path.join(output_dir, f"{function}.diff"), "w") as diff:
+                diff.write("")
+    return functions, "\n".join(stdout_lines).encode(), diffkemp_out
+
+
+def legacy_classify(functions, compare_result, diffkemp_out, diffkemp_out_dir):
+    """The original classification, kept as a reference for the benchmark."""
+    tag_results = {}
+    for function in functions:
+        if f"{function}: unknown" in compare_result.decode():
+            diff_type = DiffType.UNKNOWN
+        elif function in map(lambda x: x["function"], diffkemp_out["results"]):
+            diff_type = DiffType.SEMANTIC
+        elif f"{function}.diff" in os.listdir(diffkemp_out_dir):
+            diff_type = DiffType.SYNTACTIC
+        else:
+            diff_type = DiffType.NO_DIFF
+        tag_results[function] = diff_type.value
+    return tag_results
+
+
+def benchmark_classify(args):
+    """Measure the classification time for growing numbers of functions."""
+    print(f"{'functions':>10} {'classify [s]':>14} {'legacy [s]':>12}")
+    for size in map(int, args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as output_dir:
+            functions, stdout, diffkemp_out = synthesize_output(size, output_dir)
+            start = time.perf_counter()
+            results = Comparator.classify(functions, stdout, diffkemp_out, output_dir)
+            elapsed = time.perf_counter() - start
+
+            legacy = "-"
+            if size <= args.legacy_limit:
+                start = time.perf_counter()
+                legacy_results = legacy_classify(
+                    functions, stdout, diffkemp_out, output_dir
+                )
+                legacy = f"{time.perf_counter() - start:.3f}"
+                if legacy_results != results:
+                    print(f"WARNING: Classifications differ for {size} functions.")
+        print(f"{size:>10} {elapsed:>14.3f} {legacy:>12}")
+
+
+def benchmark_blame(args):
+    """
+    Measure the time of finding the commits of all semantically different
+    functions using both engines and report how much the engines agree.
+    """
+    with open(args.diffkemp_out, "r") as diffkemp_out_file:
+        diffkemp_out = load_yaml(diffkemp_out_file)
+    functions = [result["function"] for result in diffkemp_out["results"]]
+
+    commits = {}
+    for engine in [LOG_ENGINE, HUNKS_ENGINE]:
+        finder = CommitLinkFinder(
+            args.repo, args.old_tag, args.new_tag, diffkemp_out, engine=engine
+        )
+        start = time.perf_counter()
+        finder.prefetch(functions)
+        commits[engine] = {f: set(finder.get_commit_links(f)) for f in functions}
+        print(f"{engine:>6}: {time.perf_counter() - start:.3f} s")
+
+    same = [
+        f for f in functions if commits[LOG_ENGINE][f] == commits[HUNKS_ENGINE][f]
+    ]
+    print(f"Identical commits for {len(same)} of {len(functions)} functions.")
+    for function in functions:
+        log_commits = commits[LOG_ENGINE][function]
+        hunks_commits = commits[HUNKS_ENGINE][function]
+        if log_commits != hunks_commits:
+            print(
+                f"  {function}: {len(log_commits - hunks_commits)} only in log, "
+                f"{len(hunks_commits - log_commits)} only in hunks"
+            )
+
+
+def benchmark_results(args):
+    """
+    Measure the memory taken by the results of synthetic comparisons loaded
+    from a file and the time of computing their statistics in both
+    representations.
+    """
+    diff_types = [diff_type.value for diff_type in DiffType]
+    functions = [f"function_{i}" for i in range(args.functions)]
+    items = (
+        (
+            ComparisonResults.key(f"v{pair}", f"v{pair + 1}"),
+            {f: diff_types[(i * (pair + 1)) % 4] for i, f in enumerate(functions)},
+        )
+        for pair in range(args.pairs)
+    )
+
+    print(f"{'results':>18} {'memory [MiB]':>14} {'stats [s]':>11}")
+    with tempfile.TemporaryDirectory() as results_dir:
+        results_file = os.path.join(results_dir, "results.jsonl")
+        write_results(results_file, items)
+        for results_class in [ComparisonResults, ColumnarResults]:
+            tracemalloc.start()
+            results = results_class.load(results_file)
+            memory = tracemalloc.get_traced_memory()[0] / 1024**2
+            tracemalloc.stop()
+            start = time.perf_counter()
+            results.get_stats()
+            elapsed = time.perf_counter() - start
+            print(f"{results_class.__name__:>18} {memory:>14.1f} {elapsed:>11.3f}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark == "classify":
+        benchmark_classify(args)
+    elif args.benchmark == "blame":
+        benchmark_blame(args)
+    elif args.benchmark == "results":
+        benchmark_results(args)
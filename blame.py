@@ -1,23 +1,315 @@
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from git import Repo, GitCommandError
+from storage import dump_yaml, load_yaml
+
+
+LOG_ENGINE = "log"
+HUNKS_ENGINE = "hunks"
+BLAME_ENGINES = [LOG_ENGINE, HUNKS_ENGINE]
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# Diff lines are always prefixed, so this cannot start any line of a patch
+COMMIT_MARKER = "commit "
+
+
+def find_function_end(lines, start):
+    """
+    Find the last line of a C function whose definition starts at the given
+    line by matching its braces. Line numbers are 1-based.
+    """
+    depth = 0
+    opened = False
+    in_comment = False
+    for number in range(start, len(lines) + 1):
+        line = lines[number - 1]
+        i = 0
+        while i < len(line):
+            char = line[i]
+            if in_comment:
+                if line.startswith("*/", i):
+                    in_comment = False
+                    i += 1
+            elif line.startswith("//", i):
+                break
+            elif line.startswith("/*", i):
+                in_comment = True
+                i += 1
+            elif char in "\"'":
+                # Skip string and character literals
+                i += 1
+                while i < len(line) and line[i] != char:
+                    i += 2 if line[i] == "\\" else 1
+            elif char == "{":
+                depth += 1
+                opened = True
+            elif char == "}":
+                depth -= 1
+                if opened and depth == 0:
+                    return number
+            i += 1
+    return len(lines)
+
+
+def map_line(hunks, line, end):
+    """
+    Map a line number from the version after a commit to the version before
+    it using the hunks of the commit. Lines inside a hunk are mapped to the
+    first (or the last if end is set) line of its pre-image.
+    """
+    offset = 0
+    for old_start, old_len, new_start, new_len in hunks:
+        if new_len > 0 and new_start <= line < new_start + new_len:
+            if old_len == 0:
+                return old_start if end else old_start + 1
+            return old_start + old_len - 1 if end else old_start
+        if (new_len > 0 and new_start + new_len <= line) or (
+            new_len == 0 and new_start < line
+        ):
+            offset += new_len - old_len
+        else:
+            break
+    return line - offset
+
+
+def touches(hunks, start, end):
+    """Check whether any hunk changes a line in the given range."""
+    for _, _, new_start, new_len in hunks:
+        if new_len > 0 and new_start <= end and start < new_start + new_len:
+            return True
+        if new_len == 0 and start <= new_start < end:
+            return True
+    return False
+
+
+class HunkCommitFinder:
+    """
+    Class for attributing commits to functions using a single pass over the
+    patches of all commits between two tags. The line range of each function
+    is traced back through the hunks of the commits along every parent of
+    merges, which is much faster than running git log -L for each function
+    separately. Renames of files are not followed.
+    """
+
+    def __init__(self, repo, old_tag, new_tag):
+        self.repo = repo
+        self.old_tag = old_tag
+        self.new_tag = new_tag
+
+    def get_graph(self):
+        """
+        Return the commits between the tags with their parents, from the
+        newest one. Each commit precedes all of its parents.
+        """
+        graph = []
+        for line in self.repo.git.rev_list(
+            "--topo-order", "--parents", f"{self.old_tag}..{self.new_tag}"
+        ).splitlines():
+            sha, *parents = line.split()
+            graph.append((sha, parents))
+        return graph
+
+    def get_patches(self, graph, files):
+        """
+        Return a dictionary mapping pairs of a commit and one of its parents
+        to the hunks of the given files changed between them.
+        """
+        with tempfile.TemporaryFile("w+") as pairs:
+            for sha, parents in graph:
+                for parent in parents:
+                    pairs.write(f"{sha} {parent}\n")
+            pairs.seek(0)
+            # Each input line is diffed as a commit with a single parent
+            log = self.repo.git.diff_tree(
+                "--stdin",
+                "-p",
+                "-U0",
+                "--no-renames",
+                f"--format={COMMIT_MARKER}%H %P",
+                "--",
+                *sorted(files),
+                istream=pairs,
+            )
+        patches = {}
+        file_hunks = None
+        file = None
+        in_header = False
+        for line in log.splitlines():
+            if line.startswith(COMMIT_MARKER):
+                sha, parent = line[len(COMMIT_MARKER) :].split()
+                file_hunks = patches.setdefault((sha, parent), {})
+                in_header = False
+            elif line.startswith("diff --git "):
+                file = None
+                in_header = True
+            elif in_header and line.startswith("+++ "):
+                # Deleted files have /dev/null as the new path
+                file = line[6:] if line.startswith("+++ b/") else None
+            elif line.startswith("@@"):
+                in_header = False
+                match = HUNK_HEADER.match(line)
+                if match is None or file is None or file_hunks is None:
+                    continue
+                old_start, old_len, new_start, new_len = match.groups()
+                file_hunks.setdefault(file, []).append(
+                    (
+                        int(old_start),
+                        1 if old_len is None else int(old_len),
+                        int(new_start),
+                        1 if new_len is None else int(new_len),
+                    )
+                )
+        return patches
+
+    def get_ranges(self, lookups):
+        """Find the line ranges of the looked up functions in the new tag."""
+        ranges = {}
+        file_lines = {}
+        for (function, file), start in lookups.items():
+            if file not in file_lines:
+                try:
+                    content = self.repo.git.show(f"{self.new_tag}:{file}")
+                except GitCommandError:
+                    content = None
+                file_lines[file] = content.splitlines() if content else None
+            if file_lines[file] is None or start is None:
+                continue
+            end = find_function_end(file_lines[file], start)
+            ranges[(function, file)] = (start, end)
+        return ranges
+
+    def find(self, lookups):
+        """
+        Given a dictionary mapping pairs of a function and its file to the
+        first line of the function in the new tag, return a dictionary mapping
+        the same pairs to the lists of commits changing the function.
+        """
+        ranges = self.get_ranges(lookups)
+        found = {lookup: [] for lookup in lookups}
+        graph = self.get_graph()
+        if not ranges or not graph:
+            return found
+        patches = self.get_patches(graph, {file for _, file in ranges})
+        # Line ranges of the functions in each commit, starting from the new tag
+        commit_ranges = {graph[0][0]: ranges}
+        for sha, parents in graph:
+            ranges = commit_ranges.pop(sha, None)
+            if not ranges:
+                continue
+            parent_patches = [patches.get((sha, parent), {}) for parent in parents]
+            # A merge changes a function only if it differs from all parents
+            if parent_patches and all(parent_patches):
+                for lookup, (start, end) in ranges.items():
+                    if all(
+                        touches(file_hunks.get(lookup[1], []), start, end)
+                        for file_hunks in parent_patches
+                    ):
+                        found[lookup].append(sha)
+            for parent, file_hunks in zip(parents, parent_patches):
+                if not file_hunks and parent not in commit_ranges:
+                    # Only merges pass the same ranges to multiple parents
+                    commit_ranges[parent] = dict(ranges) if len(parents) > 1 else ranges
+                    continue
+                parent_ranges = commit_ranges.setdefault(parent, {})
+                for lookup, (start, end) in ranges.items():
+                    hunks = file_hunks.get(lookup[1], [])
+                    start = map_line(hunks, start, False)
+                    end = map_line(hunks, end, True)
+                    if start > end:
+                        # The function did not exist in the parent
+                        continue
+                    if lookup in parent_ranges:
+                        # Ranges traced through different children may differ
+                        other_start, other_end = parent_ranges[lookup]
+                        start, end = min(start, other_start), max(end, other_end)
+                    parent_ranges[lookup] = (start, end)
+        return found
+
+
+class CommitCache:
+    """
+    Persistent cache of the commits which changed a function in a file
+    between two commits, as found by the given engine. The commits are
+    identified by their SHAs, since tags (and branches) may be moved.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.commits = {}
+        self.lock = threading.Lock()
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, "r") as c_file:
+                self.commits = load_yaml(c_file) or {}
+
+    @staticmethod
+    def key(function, file, old_commit, new_commit, engine):
+        """Construct a key for the cache dictionary."""
+        return f"{engine}:{old_commit}..{new_commit}:{file}:{function}"
+
+    def get(self, function, file, old_commit, new_commit, engine):
+        """Return the cached commits or None if they are not cached."""
+        with self.lock:
+            return self.commits.get(
+                self.key(function, file, old_commit, new_commit, engine)
+            )
+
+    def set(self, function, file, old_commit, new_commit, engine, commits):
+        """Store the commits in the cache."""
+        key = self.key(function, file, old_commit, new_commit, engine)
+        with self.lock:
+            self.commits[key] = commits
+
+    def dump(self):
+        """Export the cache to its file."""
+        if self.cache_file is None:
+            return
+        with self.lock:
+            with open(self.cache_file, "w") as c_file:
+                dump_yaml(self.commits, c_file)
 
 
 class CommitLinkFinder:
-    def __init__(self, repo_path, old_tag, new_tag, diffkemp_out):
+    def __init__(
+        self,
+        repo_path,
+        old_tag,
+        new_tag,
+        diffkemp_out,
+        cache=None,
+        jobs=1,
+        engine=LOG_ENGINE,
+    ):
         self.repo = Repo(repo_path)
         self.repo_url = self.repo.remotes.origin.url.split(".git")[0]
         self.old_tag = old_tag
         self.new_tag = new_tag
+        self.old_commit = self.resolve_commit(old_tag)
+        self.new_commit = self.resolve_commit(new_tag)
         self.diffkemp_results = self.list_to_dict(diffkemp_out["results"], "function")
         self.diffkemp_definitions = diffkemp_out["definitions"]
+        self.cache = cache if cache is not None else CommitCache()
+        self.jobs = max(jobs, 1)
+        self.engine = engine
 
     @staticmethod
     def list_to_dict(list, key):
         return {item[key]: item for item in list}
 
+    def resolve_commit(self, tag):
+        """Return the SHA of the commit of a tag, or None if it does not exist."""
+        try:
+            return self.repo.git.rev_parse("--verify", f"{tag}^{{commit}}")
+        except GitCommandError:
+            return None
+
     def sha_to_link(self, sha):
         return f"{self.repo_url}/commit/{sha}"
 
     def get_commits_from_log(self, function, file):
+        """Return the commits changing the function, or None if git log fails."""
         try:
             commits = self.repo.git.log(
                 "-q",
@@ -26,20 +318,97 @@ class CommitLinkFinder:
                 f"{self.old_tag}..{self.new_tag}",
             )
         except GitCommandError:
-            return []
+            return None
         return commits.split()
 
-    def get_commits_for_function(self, function):
+    def get_commits_from_hunks(self, lookups):
+        finder = HunkCommitFinder(self.repo, self.old_tag, self.new_tag)
+        return finder.find(
+            {
+                (function, file): self.get_definition_line(function)
+                for function, file in lookups
+            }
+        )
+
+    def get_definition_file(self, function):
         try:
-            file = self.diffkemp_definitions[function]["new"]["file"]
+            return self.diffkemp_definitions[function]["new"]["file"]
         except KeyError:
-            return []
-        return self.get_commits_from_log(function, file)
+            return None
 
-    def get_commit_links(self, function):
+    def get_definition_line(self, function):
+        try:
+            return self.diffkemp_definitions[function]["new"]["line"]
+        except KeyError:
+            return None
+
+    def get_diff_functions(self, function):
         if function not in self.diffkemp_results:
             return []
-        functions = [d["function"] for d in self.diffkemp_results[function]["diffs"]]
+        return [d["function"] for d in self.diffkemp_results[function]["diffs"]]
+
+    def get_cached(self, function, file):
+        if self.old_commit is None or self.new_commit is None:
+            return None
+        return self.cache.get(
+            function, file, self.old_commit, self.new_commit, self.engine
+        )
+
+    def set_cached(self, function, file, commits):
+        if self.old_commit is None or self.new_commit is None:
+            return
+        self.cache.set(
+            function, file, self.old_commit, self.new_commit, self.engine, commits
+        )
+
+    def lookup_commits(self, function, file):
+        commits = self.get_cached(function, file)
+        if commits is None:
+            if self.engine == HUNKS_ENGINE:
+                found = self.get_commits_from_hunks([(function, file)])
+                commits = found[(function, file)]
+            else:
+                commits = self.get_commits_from_log(function, file)
+            # Failed lookups are not cached, so that they are retried next time
+            if commits is None:
+                return []
+            self.set_cached(function, file, commits)
+        return commits
+
+    def prefetch(self, functions):
+        """
+        Look up the commits of all functions differing in any of the given
+        functions at once. Each distinct function is looked up only once. The
+        hunks engine handles all lookups missing from the cache in a single
+        pass, otherwise they run in parallel.
+        """
+        lookups = set()
+        for function in functions:
+            for diff_function in self.get_diff_functions(function):
+                file = self.get_definition_file(diff_function)
+                if file is not None:
+                    lookups.add((diff_function, file))
+        missing = [
+            (function, file)
+            for function, file in sorted(lookups)
+            if self.get_cached(function, file) is None
+        ]
+        if self.engine == HUNKS_ENGINE:
+            found = self.get_commits_from_hunks(missing)
+            for (function, file), commits in found.items():
+                self.set_cached(function, file, commits)
+            return
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(lambda lookup: self.lookup_commits(*lookup), missing))
+
+    def get_commits_for_function(self, function):
+        file = self.get_definition_file(function)
+        if file is None:
+            return []
+        return self.lookup_commits(function, file)
+
+    def get_commit_links(self, function):
+        functions = self.get_diff_functions(function)
         commit_lists = [self.get_commits_for_function(f) for f in functions]
         commit_set = set(sum(commit_lists, []))
         commit_links = [self.sha_to_link(sha) for sha in commit_set]
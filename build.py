@@ -1,92 +1,242 @@
+import hashlib
 import subprocess
 import shutil
 import os
+import re
+import threading
+from buildcache import CLANG_WRAPPER
+from cache import resolve_commit
+from instrument import profiler
 
 
-def clone_repository(verbose, repo_url, source_dir):
-    """Clone a repository."""
-    os.makedirs(source_dir, exist_ok=True)
-    git_clone_command = ["git", "clone", repo_url, source_dir]
-    print(f"Cloning {repo_url}.")
-    if verbose:
-        print(" ".join(git_clone_command))
-    out = None if verbose else subprocess.DEVNULL
-    subprocess.check_call(git_clone_command, stdout=out, stderr=out)
+worktree_lock = threading.Lock()
 
 
-def build_snapshot(verbose, diffkemp, config, tag, source_dir, build_dir, snapshot_dir):
-    """Build a snapshot of a project for the release specified by a tag."""
+def run_command(verbose, command, **kwargs):
+    """Run a command, printing it and its output only in verbose mode."""
     out = None if verbose else subprocess.DEVNULL
+    if verbose:
+        print(command if isinstance(command, str) else " ".join(command))
+    profiler.run(command, stdout=out, stderr=out, **kwargs)
+
+
+def get_mirror_dir(mirrors_dir, repo_url):
+    """Return the directory of the bare mirror of a repository."""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.basename(repo_url.rstrip("/")))
+    if name.endswith(".git"):
+        name = name[: -len(".git")]
+    digest = hashlib.sha256(repo_url.encode()).hexdigest()[:12]
+    return os.path.join(mirrors_dir, f"{name}-{digest}.git")
+
+
+def get_missing_tags(repo_dir, tags):
+    """Return the tags which cannot be resolved in a repository."""
+    missing = []
+    for tag in tags:
+        try:
+            resolve_commit(repo_dir, tag)
+        except subprocess.CalledProcessError:
+            missing.append(tag)
+    return missing
+
+
+def fetch_tags(verbose, remote, repo_dir, tags):
+    """
+    Fetch the given tags from a remote. If some of them are not tags (e.g.,
+    branches or commits), fetch all branches and tags instead.
+    """
+    print(f"Fetching {', '.join(map(str, tags))} into {repo_dir}.")
+    refspecs = [f"refs/tags/{tag}:refs/tags/{tag}" for tag in tags]
+    try:
+        run_command(verbose, ["git", "fetch", remote, *refspecs], cwd=repo_dir)
+    except subprocess.CalledProcessError:
+        run_command(verbose, ["git", "fetch", "--tags", remote], cwd=repo_dir)
+
+
+def update_mirror(verbose, repo_url, mirror_dir, tags, offline=False):
+    """
+    Create a bare mirror of a repository or fetch the missing tags into an
+    existing one. Offline, the mirror is used as it is.
+    """
+    if not os.path.isdir(mirror_dir):
+        if offline:
+            raise FileNotFoundError(f"No mirror of {repo_url} in {mirror_dir}")
+        os.makedirs(os.path.dirname(os.path.abspath(mirror_dir)), exist_ok=True)
+        print(f"Mirroring {repo_url}.")
+        run_command(verbose, ["git", "clone", "--mirror", repo_url, mirror_dir])
+        return
+    missing = get_missing_tags(mirror_dir, tags)
+    if missing and not offline:
+        fetch_tags(verbose, "origin", mirror_dir, missing)
+
 
+def clone_repository(
+    verbose,
+    repo_url,
+    source_dir,
+    tags,
+    mirrors_dir=None,
+    offline=False,
+    blobless=False,
+):
+    """
+    Clone a repository or fetch the missing tags into an existing clone. If a
+    directory of mirrors is given, the repository is cloned from a shared bare
+    mirror, whose objects are used by the clone instead of copying them, and
+    only the mirror is fetched from the upstream repository. The clone keeps
+    the upstream repository as its origin. Without a mirror, the clone can be
+    blobless, in which case file contents are fetched on checkout.
+    """
+    remote = "origin"
+    if mirrors_dir is not None:
+        remote = os.path.abspath(get_mirror_dir(mirrors_dir, repo_url))
+        update_mirror(verbose, repo_url, remote, tags, offline)
+
+    if not os.path.isdir(source_dir):
+        if offline and mirrors_dir is None:
+            raise FileNotFoundError(f"No clone of {repo_url} in {source_dir}")
+        os.makedirs(source_dir, exist_ok=True)
+        if mirrors_dir is not None:
+            print(f"Cloning {repo_url} from {remote}.")
+            run_command(verbose, ["git", "clone", "--shared", remote, source_dir])
+            run_command(
+                verbose,
+                ["git", "remote", "set-url", "origin", repo_url],
+                cwd=source_dir,
+            )
+            return
+        git_clone_command = ["git", "clone", repo_url, source_dir]
+        if blobless:
+            git_clone_command.insert(2, "--filter=blob:none")
+        print(f"Cloning {repo_url}.")
+        run_command(verbose, git_clone_command)
+        return
+
+    missing = get_missing_tags(source_dir, tags)
+    if missing and not (offline and mirrors_dir is None):
+        fetch_tags(verbose, remote, source_dir, missing)
+
+
+def write_function_list(functions, output_dir):
+    """
+    Export the list of functions to analyze into the given directory and
+    return the path to the list. The list is read-only, so that it can be
+    safely shared by concurrent builds.
+    """
+    function_list_path = os.path.join(output_dir, "function-list")
+    with open(function_list_path, "w") as function_list_file:
+        for function_name in functions:
+            function_list_file.write(f"{function_name}\n")
+    os.chmod(function_list_path, 0o444)
+    return function_list_path
+
+
+def copy_sources(verbose, tag, source_dir, build_dir):
+    """Copy the whole cloned repository and check out the given tag."""
     # Create the appropriate directory for the build and snapshot
     os.makedirs(build_dir, exist_ok=True)
 
     # Copy source files to the build directory
-    shutil.rmtree(build_dir, ignore_errors=True)
-    shutil.copytree(source_dir, build_dir, symlinks=True)
+    with profiler.stage("copy"):
+        shutil.rmtree(build_dir, ignore_errors=True)
+        shutil.copytree(source_dir, build_dir, symlinks=True)
 
     # Run git reset to be able to do a clean checkout
-    git_reset_command = ["git", "reset", "--hard"]
-    if verbose:
-        print(" ".join(git_reset_command))
-    subprocess.check_call(
-        git_reset_command,
-        cwd=build_dir,
-        stdout=out,
-        stderr=out,
-    )
+    run_command(verbose, ["git", "reset", "--hard"], cwd=build_dir)
 
     # Run git clean to remove any untracked files
-    git_clean_command = ["git", "clean", "-fdx"]
-    if verbose:
-        print(" ".join(git_clean_command))
-    subprocess.check_call(
-        git_clean_command,
-        cwd=build_dir,
-        stdout=out,
-        stderr=out,
-    )
+    run_command(verbose, ["git", "clean", "-fdx"], cwd=build_dir)
 
     # Checkout to the desired tag
-    git_checkout_command = ["git", "checkout", tag]
-    if verbose:
-        print(" ".join(git_checkout_command))
-    subprocess.check_call(
-        git_checkout_command,
-        cwd=build_dir,
-        stdout=out,
-        stderr=out,
-    )
+    run_command(verbose, ["git", "checkout", tag], cwd=build_dir)
+
+
+def add_worktree(verbose, tag, source_dir, build_dir):
+    """
+    Check out the given tag into a new worktree of the cloned repository,
+    which shares the object store with the clone instead of copying it.
+    """
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(os.path.abspath(build_dir)), exist_ok=True)
+
+    # Git does not support concurrent modifications of the worktree list
+    with worktree_lock:
+        # Forget worktrees whose directories were removed
+        run_command(verbose, ["git", "worktree", "prune"], cwd=source_dir)
+        run_command(
+            verbose,
+            [
+                "git",
+                "worktree",
+                "add",
+                "--force",
+                "--detach",
+                os.path.abspath(build_dir),
+                tag,
+            ],
+            cwd=source_dir,
+        )
+
+
+def remove_build_dir(verbose, source_dir, build_dir, worktree=False):
+    """Remove a build directory, including its worktree, if it is one."""
+    if worktree:
+        with worktree_lock:
+            run_command(
+                verbose,
+                [
+                    "git",
+                    "worktree",
+                    "remove",
+                    "--force",
+                    os.path.abspath(build_dir),
+                ],
+                cwd=source_dir,
+            )
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def build_snapshot(
+    verbose,
+    diffkemp,
+    config,
+    tag,
+    source_dir,
+    build_dir,
+    snapshot_dir,
+    function_list_path,
+    worktree=False,
+    build_cache=None,
+):
+    """
+    Build a snapshot of a project for the release specified by a tag. If a
+    build cache is given, the results of the configuration commands and the
+    compiled sources of other builds are reused where possible.
+    """
+    # Prepare the sources of the desired release in the build directory
+    if worktree:
+        add_worktree(verbose, tag, source_dir, build_dir)
+    else:
+        copy_sources(verbose, tag, source_dir, build_dir)
 
     # Update submodules
-    git_submodule_command = ["git", "submodule", "update", "--init", "--recursive"]
-    if verbose:
-        print(" ".join(git_submodule_command))
-    subprocess.check_call(
-        git_submodule_command,
+    run_command(
+        verbose,
+        ["git", "submodule", "update", "--init", "--recursive"],
         cwd=build_dir,
-        stdout=out,
-        stderr=out,
     )
 
     # Run the configuration commands if necessary
     if "config-commands" in config:
-        for command in config["config-commands"]:
-            if verbose:
-                print(command)
-            subprocess.check_call(
-                command,
-                cwd=build_dir,
-                shell=True,
-                stdout=out,
-                stderr=out,
-            )
-
-    # Export a list of functions to analyze
-    function_list_path = os.path.join("/tmp", "function-list")
-    with open(function_list_path, "w") as function_list_file:
-        for function_name in config["functions"]:
-            function_list_file.write(f"{function_name}\n")
+        with profiler.stage("configure"):
+            key = None
+            if build_cache is not None:
+                key = build_cache.configure_key(verbose, source_dir, tag, config)
+            if key is None or not build_cache.restore_configure(key, build_dir):
+                for command in config["config-commands"]:
+                    run_command(verbose, command, cwd=build_dir, shell=True)
+                if key is not None:
+                    build_cache.store_configure(key, build_dir)
 
     # Construct the build command and build the project
     build_command = [
@@ -102,6 +252,8 @@ def build_snapshot(verbose, diffkemp, config, tag, source_dir, build_dir, snapsh
         )
     if "target" in config:
         build_command.append("--target=" + config["target"])
-    if verbose:
-        print(" ".join(build_command))
-    subprocess.check_call(build_command, stdout=out, stderr=out)
+    env = None
+    if build_cache is not None:
+        build_command.append(f"--clang={CLANG_WRAPPER}")
+        env = {**os.environ, **build_cache.compile_environment(build_dir)}
+    run_command(verbose, build_command, env=env)
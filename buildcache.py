@@ -0,0 +1,335 @@
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from cache import get_dir_size
+from instrument import profiler
+
+COMPILE_DIRNAME = "compile"
+CONFIGURE_DIRNAME = "configure"
+FILES_DIRNAME = "files"
+TMP_SUFFIX = ".tmp"
+
+# Absolute paths to the build directory are replaced by this placeholder in
+# the cached files, so that they can be reused in builds of other versions
+BUILD_DIR_PLACEHOLDER = b"@DIFFKEMP_BUILD_DIR@"
+
+# Environment variables passing the settings to the compiler wrapper
+CACHE_DIR_VARIABLE = "DIFFKEMP_BUILD_CACHE"
+BUILD_DIR_VARIABLE = "DIFFKEMP_BUILD_DIR"
+CLANG_VARIABLE = "DIFFKEMP_CLANG"
+CLANG_WRAPPER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "clang-cache.py"
+)
+
+# Files whose contents determine the results of the configuration commands,
+# unless given by the configure-inputs field of the configuration. The names
+# are matched regardless of the case (e.g., OpenSSL has Configure).
+CONFIGURE_INPUTS = [
+    "configure",
+    "configure.ac",
+    "configure.in",
+    "autogen.sh",
+    "*.m4",
+    "Makefile",
+    "GNUmakefile",
+    "Makefile.am",
+    "Makefile.in",
+    "CMakeLists.txt",
+    "*.cmake",
+    "meson.build",
+    "meson_options.txt",
+    "Kconfig*",
+    "*defconfig",
+    "VERSION*",
+]
+# Status of files which are not tracked in git status --porcelain
+UNTRACKED_STATUSES = {"??", "!!"}
+
+# Options of a compilation which are not passed to the preprocessor
+COMPILE_OPTIONS = {"-c", "-S", "-emit-llvm"}
+SOURCE_EXTENSIONS = (".c", ".i")
+
+
+def get_cacheable_output(args):
+    """
+    Return the output file of a compilation of a single C source into textual
+    LLVM IR, or None if the compilation cannot be cached.
+    """
+    if "-emit-llvm" not in args or "-S" not in args or "-o" not in args:
+        return None
+    if "-E" in args or any(arg.startswith("-M") for arg in args):
+        return None
+    sources = [arg for arg in args if arg.endswith(SOURCE_EXTENSIONS)]
+    output_index = args.index("-o") + 1
+    if len(sources) != 1 or output_index >= len(args):
+        return None
+    return args[output_index]
+
+
+def preprocessor_args(args):
+    """Return the arguments of a compilation without the output options."""
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == "-o":
+            skip = True
+        elif arg not in COMPILE_OPTIONS:
+            result.append(arg)
+    return result
+
+
+class BuildCache:
+    """
+    Class for reusing the work of builds of other project versions: the
+    results of the configuration commands, reused if the configure inputs did
+    not change, and the LLVM IR of each compiled source, reused if the
+    preprocessed source and the compiler flags did not change.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.compile_dir = os.path.join(cache_dir, COMPILE_DIRNAME)
+        self.configure_dir = os.path.join(cache_dir, CONFIGURE_DIRNAME)
+        os.makedirs(self.compile_dir, exist_ok=True)
+        os.makedirs(self.configure_dir, exist_ok=True)
+
+    def compile_environment(self, build_dir):
+        """Return the environment variables enabling the compiler wrapper."""
+        return {
+            CACHE_DIR_VARIABLE: os.path.abspath(self.cache_dir),
+            BUILD_DIR_VARIABLE: os.path.abspath(build_dir),
+            CLANG_VARIABLE: os.environ.get(CLANG_VARIABLE, "clang"),
+        }
+
+    def configure_key(self, verbose, source_dir, tag, config):
+        """
+        Compute the key of the results of the configuration commands of a
+        tag from the commands and the blobs of the configure inputs. Return
+        None if the tag has no configure inputs, since the results could not
+        be told apart from those of other tags then (reported in verbose mode).
+        """
+        patterns = [
+            pattern.lower()
+            for pattern in config.get("configure-inputs", CONFIGURE_INPUTS)
+        ]
+        tree = profiler.run(
+            ["git", "ls-tree", "-r", "-z", f"{tag}^{{commit}}"],
+            cwd=source_dir,
+            stdout=subprocess.PIPE,
+        )
+        inputs = []
+        for entry in tree.decode(errors="surrogateescape").split("\0"):
+            if not entry:
+                continue
+            meta, path = entry.split("\t", 1)
+            name = os.path.basename(path).lower()
+            if any(
+                fnmatch.fnmatchcase(name, pattern)
+                or fnmatch.fnmatchcase(path.lower(), pattern)
+                for pattern in patterns
+            ):
+                inputs.append([path, meta.split()[2]])
+        if not inputs:
+            if verbose:
+                print(
+                    f"No configure inputs found in {tag}, "
+                    "not caching its configuration."
+                )
+            return None
+        key_fields = {
+            "config-commands": config.get("config-commands"),
+            "inputs": sorted(inputs),
+        }
+        return hashlib.sha256(
+            json.dumps(key_fields, sort_keys=True).encode()
+        ).hexdigest()
+
+    def restore_configure(self, key, build_dir):
+        """
+        Copy the cached results of the configuration commands into the build
+        directory. Tracked files of the build directory are never replaced.
+        Return False if the results are not cached.
+        """
+        files_dir = os.path.join(self.configure_dir, key, FILES_DIRNAME)
+        if not os.path.isdir(files_dir):
+            return False
+        os.utime(os.path.join(self.configure_dir, key))
+        build_dir = os.path.abspath(build_dir)
+        tracked = set(
+            profiler.run(
+                ["git", "ls-files", "-z"], cwd=build_dir, stdout=subprocess.PIPE
+            )
+            .decode(errors="surrogateescape")
+            .split("\0")
+        )
+        # Equal times keep make from regenerating the restored files
+        now = time.time()
+        for root, _, files in os.walk(files_dir):
+            for file in files:
+                cached = os.path.join(root, file)
+                path = os.path.relpath(cached, files_dir)
+                if path in tracked:
+                    continue
+                target = os.path.join(build_dir, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.lexists(target):
+                    os.remove(target)
+                if os.path.islink(cached):
+                    os.symlink(os.readlink(cached), target)
+                    continue
+                copy_substituted(cached, target, BUILD_DIR_PLACEHOLDER, build_dir)
+                os.utime(target, (now, now))
+        return True
+
+    def store_configure(self, key, build_dir):
+        """
+        Cache the files created by the configuration commands, which are the
+        untracked and ignored files of the build directory. Nothing is cached
+        if the commands modified or removed tracked files, as restoring only
+        the created files would not reproduce their results.
+        """
+        build_dir = os.path.abspath(build_dir)
+        status = profiler.run(
+            [
+                "git",
+                "status",
+                "--porcelain",
+                "-z",
+                "--ignored=traditional",
+                "--untracked-files=all",
+            ],
+            cwd=build_dir,
+            stdout=subprocess.PIPE,
+        )
+        entries = [
+            entry
+            for entry in status.decode(errors="surrogateescape").split("\0")
+            if len(entry) >= 4
+        ]
+        modified = [
+            entry[3:] for entry in entries if entry[:2] not in UNTRACKED_STATUSES
+        ]
+        if modified:
+            print(
+                f"Not caching the configuration of {build_dir}, it modified "
+                f"tracked files (e.g., {modified[0]})."
+            )
+            return
+        entry_dir = os.path.join(self.configure_dir, key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        for entry in entries:
+            path = os.path.join(build_dir, entry[3:])
+            if not os.path.lexists(path) or os.path.isdir(path):
+                continue
+            cached = os.path.join(tmp_dir, FILES_DIRNAME, entry[3:])
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), cached)
+            else:
+                copy_substituted(path, cached, build_dir, BUILD_DIR_PLACEHOLDER)
+        os.makedirs(os.path.join(tmp_dir, FILES_DIRNAME), exist_ok=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another build has cached the same results meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def compile_key(self, clang, args, build_dir):
+        """
+        Compute the key of a compilation from the preprocessed source, the
+        compiler flags, the working directory and the compiler executable.
+        Return None if the source cannot be preprocessed.
+        """
+        build_dir = os.path.abspath(build_dir)
+        try:
+            preprocessed = subprocess.run(
+                [clang, "-E", *preprocessor_args(args)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        executable = shutil.which(clang) or clang
+        stat = os.stat(os.path.realpath(executable))
+        placeholder = BUILD_DIR_PLACEHOLDER.decode()
+        key_fields = {
+            "clang": [os.path.realpath(executable), stat.st_size, stat.st_mtime],
+            "args": [arg.replace(build_dir, placeholder) for arg in args],
+            "cwd": os.getcwd().replace(build_dir, placeholder),
+        }
+        digest = hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode())
+        digest.update(preprocessed.replace(build_dir.encode(), BUILD_DIR_PLACEHOLDER))
+        return digest.hexdigest()
+
+    def compiled_path(self, key):
+        """Return the path to the cached LLVM IR with the given key."""
+        return os.path.join(self.compile_dir, key[:2], f"{key}.ll")
+
+    def restore_compiled(self, key, output, build_dir):
+        """
+        Copy the cached LLVM IR into the output file. Return False if it is
+        not cached.
+        """
+        cached = self.compiled_path(key)
+        if not os.path.exists(cached):
+            return False
+        os.utime(cached)
+        copy_substituted(
+            cached, output, BUILD_DIR_PLACEHOLDER, os.path.abspath(build_dir)
+        )
+        return True
+
+    def store_compiled(self, key, output, build_dir):
+        """Cache the LLVM IR produced by a compilation."""
+        cached = self.compiled_path(key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        copy_substituted(
+            output, cached, os.path.abspath(build_dir), BUILD_DIR_PLACEHOLDER
+        )
+
+    def entries(self):
+        """
+        Return the time of the last use, the size and the path of each cached
+        compiled source and each cached result of configuration commands.
+        """
+        entries = []
+        # Temporary files and directories are still being written
+        for root, _, files in os.walk(self.compile_dir):
+            for file in files:
+                if file.endswith(TMP_SUFFIX):
+                    continue
+                stat = os.stat(os.path.join(root, file))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+        for key in os.listdir(self.configure_dir):
+            if key.endswith(TMP_SUFFIX):
+                continue
+            entry_dir = os.path.join(self.configure_dir, key)
+            entries.append(
+                (os.stat(entry_dir).st_mtime, get_dir_size(entry_dir), entry_dir)
+            )
+        return entries
+
+
+def copy_substituted(source, target, old, new):
+    """
+    Copy a file including its permissions, replacing all occurrences of old
+    with new. The target is replaced atomically.
+    """
+    old = old.encode() if isinstance(old, str) else old
+    new = new.encode() if isinstance(new, str) else new
+    with open(source, "rb") as source_file:
+        data = source_file.read()
+    tmp_target = f"{target}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+    with open(tmp_target, "wb") as target_file:
+        target_file.write(data.replace(old, new))
+    shutil.copymode(source, tmp_target)
+    os.replace(tmp_target, target)
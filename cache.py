@@ -0,0 +1,288 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import subprocess
+import time
+from contextlib import contextmanager
+from instrument import profiler
+from storage import dump_yaml, load_yaml
+
+
+MANIFEST_FILENAME = "manifest.yml"
+SNAPSHOT_DIRNAME = "snapshot"
+LOCK_SUFFIX = ".lock"
+
+# Configuration fields which influence the contents of a built snapshot
+SNAPSHOT_CONFIG_FIELDS = ["config-commands", "clang-append", "target", "functions"]
+
+
+def get_diffkemp_version(diffkemp):
+    """
+    Return a string identifying the used DiffKemp. Use the reported version
+    if DiffKemp supports it, otherwise fall back to a hash of the executable.
+    """
+    try:
+        return (
+            profiler.run(
+                [diffkemp, "--version"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    executable = shutil.which(diffkemp) or diffkemp
+    with open(executable, "rb") as executable_file:
+        return hashlib.sha256(executable_file.read()).hexdigest()
+
+
+def resolve_commit(source_dir, tag):
+    """Return the SHA of the commit the given tag points to."""
+    return (
+        profiler.run(
+            ["git", "rev-parse", f"{tag}^{{commit}}"],
+            cwd=source_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        .decode()
+        .strip()
+    )
+
+
+def get_dir_size(path):
+    """Return the total size of all files in a directory in bytes."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                file_stat = os.lstat(os.path.join(root, file))
+            except FileNotFoundError:
+                # Removed by a build running meanwhile
+                continue
+            if not stat.S_ISLNK(file_stat.st_mode):
+                size += file_stat.st_size
+    return size
+
+
+@contextmanager
+def lock(path, wait=True):
+    """
+    Lock a build directory or a cache entry using a lock file next to it, so
+    that other threads and processes do not remove it while it is in use.
+    Without waiting, yield whether the lock was acquired.
+    """
+    lock_path = f"{os.path.normpath(path)}{LOCK_SUFFIX}"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    while True:
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            # The lock file may have been removed together with the path
+            # while waiting, then the lock has to be taken on the new one
+            try:
+                if os.stat(lock_path).st_ino != os.fstat(lock_file.fileno()).st_ino:
+                    continue
+            except FileNotFoundError:
+                continue
+            yield True
+            return
+
+
+def is_locked(path):
+    """Check whether a build directory or a cache entry is in use."""
+    if not os.path.exists(f"{os.path.normpath(path)}{LOCK_SUFFIX}"):
+        return False
+    with lock(path, wait=False) as acquired:
+        return not acquired
+
+
+def remove_lock_file(path):
+    """Remove the lock file of a path, the caller must hold the lock."""
+    try:
+        os.remove(f"{os.path.normpath(path)}{LOCK_SUFFIX}")
+    except FileNotFoundError:
+        pass
+
+
+def remove_locked(path):
+    """
+    Remove a build directory, a cache entry or a file together with its lock
+    file. The caller must hold the lock.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+    remove_lock_file(path)
+
+
+def select_evicted(entries, max_size, keep=()):
+    """
+    Select the least recently used entries to remove so that the total size
+    of the entries fits into the maximum size. Entries are tuples of the time
+    of the last use, the size and the name. Entries with names in keep are
+    never selected.
+    """
+    total_size = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, name in sorted(entries):
+        if total_size <= max_size:
+            break
+        if name in keep:
+            continue
+        evicted.append(name)
+        total_size -= size
+    return evicted
+
+
+class SnapshotCache:
+    """
+    Class for reusing built snapshots. Snapshots are stored under a key that
+    is a hash of the built commit, the build-related configuration and the
+    DiffKemp version, so a snapshot is reused only if all of them are equal.
+    """
+
+    def __init__(self, cache_dir, diffkemp_version, max_size=None):
+        self.cache_dir = cache_dir
+        self.diffkemp_version = diffkemp_version
+        self.max_size = max_size
+        # Keys of the snapshots used by this run, which are never removed
+        self.used = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, commit, config):
+        """Compute the cache key of a snapshot of the given commit."""
+        key_fields = {
+            "commit": commit,
+            "diffkemp": self.diffkemp_version,
+            "config": {field: config.get(field) for field in SNAPSHOT_CONFIG_FIELDS},
+        }
+        return hashlib.sha256(
+            json.dumps(key_fields, sort_keys=True).encode()
+        ).hexdigest()
+
+    def entry_dir(self, key):
+        """Return the directory of the cache entry with the given key."""
+        return os.path.join(self.cache_dir, key)
+
+    def snapshot_dir(self, key):
+        """Return the directory of the cached snapshot with the given key."""
+        return os.path.join(self.entry_dir(key), SNAPSHOT_DIRNAME)
+
+    def manifest_path(self, key):
+        """Return the path to the manifest of the entry with the given key."""
+        return os.path.join(self.entry_dir(key), MANIFEST_FILENAME)
+
+    def load_manifest(self, key):
+        """Load the manifest of a cache entry, return None if it is missing."""
+        try:
+            with open(self.manifest_path(key), "r") as manifest_file:
+                return load_yaml(manifest_file)
+        except FileNotFoundError:
+            return None
+
+    def write_manifest(self, key, manifest):
+        """Write the manifest of a cache entry."""
+        with open(self.manifest_path(key), "w") as manifest_file:
+            dump_yaml(manifest, manifest_file)
+
+    def lookup(self, key):
+        """
+        Check whether a complete snapshot with the given key is cached and
+        mark it as recently used if it is.
+        """
+        manifest = self.load_manifest(key)
+        if manifest is None or not os.path.isdir(self.snapshot_dir(key)):
+            return False
+        manifest["last-used"] = time.time()
+        self.write_manifest(key, manifest)
+        return True
+
+    def prepare(self, key):
+        """Remove any incomplete entry with the given key before a build."""
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        os.makedirs(self.entry_dir(key))
+
+    def store(self, key, project_name, tag, commit, config):
+        """Record a successfully built snapshot in the cache."""
+        now = time.time()
+        self.write_manifest(
+            key,
+            {
+                "project": project_name,
+                "tag": tag,
+                "commit": commit,
+                "diffkemp": self.diffkemp_version,
+                "config": {
+                    field: config[field]
+                    for field in SNAPSHOT_CONFIG_FIELDS
+                    if field in config
+                },
+                "size": get_dir_size(self.snapshot_dir(key)),
+                "created": now,
+                "last-used": now,
+            },
+        )
+
+    def link(self, key, snapshot_dir):
+        """Make the snapshot directory point to the cached snapshot."""
+        if os.path.islink(snapshot_dir) or os.path.isfile(snapshot_dir):
+            os.remove(snapshot_dir)
+        elif os.path.isdir(snapshot_dir):
+            shutil.rmtree(snapshot_dir)
+        target = os.path.relpath(
+            os.path.abspath(self.snapshot_dir(key)),
+            os.path.dirname(os.path.abspath(snapshot_dir)),
+        )
+        os.symlink(target, snapshot_dir)
+        self.used.add(key)
+
+    def evict(self, keep=()):
+        """
+        Remove the least recently used entries until the cache fits into its
+        maximum size. Entries with keys in keep and the snapshots used by this
+        run are never removed.
+        """
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        keep = set(keep) | self.used
+        keep |= {key for _, _, key in entries if is_locked(self.entry_dir(key))}
+        for key in select_evicted(entries, self.max_size, keep):
+            self.remove(key)
+
+    def entries(self):
+        """
+        Return the time of the last use, the size and the key of each entry
+        of the cache, including entries of builds still running in this or
+        another process.
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key.endswith(LOCK_SUFFIX):
+                continue
+            manifest = self.load_manifest(key)
+            if manifest is None:
+                # Entries of failed or interrupted builds
+                last_used, size = 0, get_dir_size(self.entry_dir(key))
+            else:
+                last_used, size = manifest["last-used"], manifest["size"]
+            entries.append((last_used, size, key))
+        return entries
+
+    def remove(self, key):
+        """Remove the entry with the given key unless a build is using it."""
+        with lock(self.entry_dir(key), wait=False) as acquired:
+            if not acquired:
+                return
+            print(f"Evicting snapshot {key} from the cache.")
+            remove_locked(self.entry_dir(key))
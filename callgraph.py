@@ -0,0 +1,130 @@
+import os
+import re
+
+
+LLVM_EXTENSION = ".ll"
+
+# Symbol names in LLVM IR are either plain identifiers or quoted strings
+SYMBOL = r'@("[^"]*"|[-\w$.]+)'
+SOURCE_FILENAME_RE = re.compile(r'^source_filename = "([^"]*)"')
+DIFILE_RE = re.compile(r'!DIFile\(filename: "([^"]*)", directory: "([^"]*)"')
+DEFINE_RE = re.compile(rf"^define ([^@]*){SYMBOL}\(")
+GLOBAL_RE = re.compile(rf"^{SYMBOL} = (.*)$")
+REFERENCE_RE = re.compile(SYMBOL)
+# Linkages of symbols which are not visible outside of their module
+LOCAL_LINKAGES = {"private", "internal"}
+
+
+def symbol_name(symbol):
+    """Return the name of a symbol without the quotes."""
+    return symbol[1:-1] if symbol.startswith('"') else symbol
+
+
+def references(text):
+    """Return the names of the symbols referenced in a piece of LLVM IR."""
+    return {
+        symbol_name(symbol)
+        for symbol in REFERENCE_RE.findall(text)
+        if not symbol.startswith("llvm.")
+    }
+
+
+class CallGraph:
+    """
+    Class describing which symbols the functions and global variables of a
+    snapshot reference, and from which source files the LLVM modules defining
+    them were compiled. Symbols with private or internal linkage (e.g., string
+    literals and static functions) are resolved within their module only.
+    Indirect calls through pointers loaded from memory are not a part of the
+    graph, the same as for DiffKemp itself.
+    """
+
+    def __init__(self):
+        # Source files of each module
+        self.modules = []
+        # (module index, symbol name) -> names of the referenced symbols
+        self.symbols = {}
+        # Symbol name -> indices of the modules defining it, by the linkage
+        self.external = {}
+        self.local = {}
+
+    def add_symbol(self, module, name, linkage, text):
+        """Add a definition of a symbol referencing the symbols in the text."""
+        self.symbols[(module, name)] = references(text)
+        definitions = self.local if linkage in LOCAL_LINKAGES else self.external
+        definitions.setdefault(name, []).append(module)
+
+    def add_module(self, module_file):
+        """Add the definitions of an LLVM IR module to the graph."""
+        module = len(self.modules)
+        files = set()
+        name = None
+        linkage = None
+        body = None
+        with open(module_file, "r", errors="surrogateescape") as ll_file:
+            for line in ll_file:
+                if body is not None:
+                    if line.startswith("}"):
+                        self.add_symbol(module, name, linkage, "".join(body))
+                        body = None
+                    else:
+                        body.append(line)
+                    continue
+                if line.startswith("source_filename "):
+                    match = SOURCE_FILENAME_RE.match(line)
+                    files.add(os.path.normpath(match.group(1)))
+                elif line.startswith("define "):
+                    match = DEFINE_RE.match(line)
+                    linkage = (match.group(1).split() or [None])[0]
+                    name = symbol_name(match.group(2))
+                    body = [line[match.end() :]]
+                elif line.startswith("@"):
+                    symbol, value = GLOBAL_RE.match(line).groups()
+                    # External global variables are only declared here
+                    if not value.startswith("external "):
+                        self.add_symbol(
+                            module, symbol_name(symbol), value.split()[0], value
+                        )
+                elif line.startswith("!") and "!DIFile(" in line:
+                    filename, directory = DIFILE_RE.search(line).groups()
+                    files.add(os.path.normpath(os.path.join(directory, filename)))
+        self.modules.append(files)
+
+    @classmethod
+    def load(cls, snapshot_dir):
+        """Build the graph from all LLVM IR modules of a snapshot."""
+        graph = cls()
+        for root, _, files in os.walk(snapshot_dir):
+            for file in sorted(files):
+                if file.endswith(LLVM_EXTENSION):
+                    graph.add_module(os.path.join(root, file))
+        return graph
+
+    def source_files(self, function):
+        """
+        Return the source files of the modules defining the function and all
+        symbols it transitively references, or None if the function is not
+        defined in the snapshot. Symbols defined outside of the snapshot
+        (e.g., in the C library) are skipped.
+        """
+        modules = self.external.get(function) or self.local.get(function)
+        if not modules:
+            return None
+        files = set()
+        visited = set()
+        pending = [(module, function) for module in modules]
+        while pending:
+            node = pending.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            module = node[0]
+            files |= self.modules[module]
+            for name in self.symbols[node]:
+                if module in self.local.get(name, ()):
+                    pending.append((module, name))
+                else:
+                    pending.extend(
+                        (other, name) for other in self.external.get(name, ())
+                    )
+        return files
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+
+# Compiler wrapper passed to diffkemp build, reusing the LLVM IR of sources
+# compiled by builds of other project versions. The real compiler, the cache
+# and the build directory are given by environment variables set by
+# build_snapshot.
+
+import os
+import subprocess
+import sys
+from buildcache import (
+    BUILD_DIR_VARIABLE,
+    CACHE_DIR_VARIABLE,
+    CLANG_VARIABLE,
+    BuildCache,
+    get_cacheable_output,
+)
+
+
+def main():
+    clang = os.environ.get(CLANG_VARIABLE, "clang")
+    args = sys.argv[1:]
+    cache_dir = os.environ.get(CACHE_DIR_VARIABLE)
+    build_dir = os.environ.get(BUILD_DIR_VARIABLE)
+    output = get_cacheable_output(args)
+    if cache_dir is None or build_dir is None or output is None:
+        os.execvp(clang, [clang, *args])
+
+    cache = BuildCache(cache_dir)
+    key = cache.compile_key(clang, args, build_dir)
+    if key is not None and cache.restore_compiled(key, output, build_dir):
+        return 0
+    status = subprocess.call([clang, *args])
+    if status == 0 and key is not None:
+        cache.store_compiled(key, output, build_dir)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import array
+import threading
+from compare import ComparisonResults, DiffType
+from storage import iter_results, write_results
+
+# NumPy is optional, statistics are computed using the standard library
+# if it is not installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+DIFF_TYPES = list(DiffType)
+DIFF_TYPE_CODES = {diff_type.value: code for code, diff_type in enumerate(DIFF_TYPES)}
+# Code of functions which were not compared in a comparison
+MISSING = -1
+
+
+class ColumnarResults:
+    """
+    Compact alternative to ComparisonResults with the same interface. Tag
+    pairs and functions are interned to integer indexes and the results of
+    each comparison are stored as a column of one-byte result codes indexed
+    by functions. Statistics are computed by vectorized passes over the
+    columns, using NumPy if it is installed.
+    """
+
+    def __init__(self, results=None):
+        self.functions = []
+        self.function_indexes = {}
+        self.keys = []
+        self.key_indexes = {}
+        self.columns = []
+        self.lock = threading.Lock()
+        for key, tag_results in (results or {}).items():
+            self.add_key(key, tag_results)
+
+    key = staticmethod(ComparisonResults.key)
+
+    def intern(self, function):
+        """Return the index of a function, adding it if it is new."""
+        index = self.function_indexes.get(function)
+        if index is None:
+            index = len(self.functions)
+            self.function_indexes[function] = index
+            self.functions.append(function)
+        return index
+
+    def add_key(self, key, tag_results):
+        """Add the results of a comparison stored under the given key."""
+        with self.lock:
+            indexes = [self.intern(function) for function in tag_results]
+            column = array.array("b", [MISSING]) * len(self.functions)
+            for index, result in zip(indexes, tag_results.values()):
+                column[index] = DIFF_TYPE_CODES[result]
+            if key in self.key_indexes:
+                self.columns[self.key_indexes[key]] = column
+            else:
+                self.key_indexes[key] = len(self.keys)
+                self.keys.append(key)
+                self.columns.append(column)
+
+    def add(self, old_tag, new_tag, tag_results):
+        """Add comparison between two tags to the results."""
+        self.add_key(self.key(old_tag, new_tag), tag_results)
+
+    def get_key(self, key):
+        """Get the comparison stored under the given key as a dictionary."""
+        column = self.columns[self.key_indexes[key]]
+        return {
+            self.functions[index]: DIFF_TYPES[code].value
+            for index, code in enumerate(column)
+            if code != MISSING
+        }
+
+    def get(self, old_tag, new_tag):
+        """Get comparison between two tags from the results."""
+        return self.get_key(self.key(old_tag, new_tag))
+
+    @property
+    def results(self):
+        """The results in the layout of ComparisonResults.results."""
+        return {key: self.get_key(key) for key in self.keys}
+
+    def items(self):
+        """Yield pairs of a key and the results of one comparison at a time."""
+        for key in list(self.keys):
+            yield key, self.get_key(key)
+
+    def sort(self, tag_pairs):
+        """Order the results according to the given list of tag pairs."""
+        with self.lock:
+            keys = [self.key(old_tag, new_tag) for old_tag, new_tag in tag_pairs]
+            ordered = [key for key in keys if key in self.key_indexes]
+            listed = set(ordered)
+            ordered.extend(key for key in self.keys if key not in listed)
+            self.columns = [self.columns[self.key_indexes[key]] for key in ordered]
+            self.keys = ordered
+            self.key_indexes = {key: index for index, key in enumerate(ordered)}
+
+    @classmethod
+    def load(cls, results_file):
+        """Load results from a file in any of the supported formats."""
+        results = cls()
+        for key, tag_results in iter_results(results_file):
+            results.add_key(key, tag_results)
+        return results
+
+    def dump(self, results_file):
+        """Export the results to a file, one comparison at a time."""
+        write_results(results_file, self.items())
+
+    def matrix(self):
+        """
+        Return the result codes as a NumPy matrix with a row per comparison
+        and a column per function.
+        """
+        matrix = numpy.full((len(self.keys), len(self.functions)), MISSING, "b")
+        for row, column in enumerate(self.columns):
+            matrix[row, : len(column)] = numpy.frombuffer(column, "b")
+        return matrix
+
+    @staticmethod
+    def count_codes(column):
+        """Count the occurrences of each result code in a column."""
+        if numpy is not None:
+            counts = numpy.bincount(
+                numpy.frombuffer(column, "b") + 1, minlength=len(DIFF_TYPES) + 1
+            )
+            return counts[1:].tolist()
+        codes = column.tobytes()
+        return [codes.count(code) for code in range(len(DIFF_TYPES))]
+
+    def get_stats(self):
+        """Return statistics about the results."""
+        stats = {}
+        for key, column in zip(self.keys, self.columns):
+            counts = self.count_codes(column)
+            stats[key] = {
+                diff_type.value: count for diff_type, count in zip(DIFF_TYPES, counts)
+            }
+        return stats
+
+    def get_totals(self):
+        """Return the numbers of results of each kind over all comparisons."""
+        totals = {diff_type.value: 0 for diff_type in DIFF_TYPES}
+        for column in self.columns:
+            for diff_type, count in zip(DIFF_TYPES, self.count_codes(column)):
+                totals[diff_type.value] += count
+        return totals
+
+    def get_function_stats(self):
+        """
+        Return the numbers of comparisons in which each function had each
+        kind of result.
+        """
+        if numpy is not None and self.keys:
+            # Give each pair of a function and a result code its own bin
+            width = len(DIFF_TYPES) + 1
+            bins = self.matrix().astype(numpy.intp) + 1
+            bins += numpy.arange(len(self.functions)) * width
+            size = len(self.functions)
+            counts = numpy.bincount(bins.ravel(), minlength=size * width)
+            counts = counts.reshape(size, width)[:, 1:].tolist()
+            return {
+                function: {
+                    diff_type.value: count
+                    for diff_type, count in zip(DIFF_TYPES, counts[index])
+                }
+                for index, function in enumerate(self.functions)
+            }
+        stats = {
+            function: {diff_type.value: 0 for diff_type in DIFF_TYPES}
+            for function in self.functions
+        }
+        for column in self.columns:
+            for index, code in enumerate(column):
+                if code != MISSING:
+                    stats[self.functions[index]][DIFF_TYPES[code].value] += 1
+        return stats
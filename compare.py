@@ -1,12 +1,44 @@
 import shutil
 import enum
+import fnmatch
+import hashlib
+import heapq
+import json
 import subprocess
 import os
 import sys
-import yaml
+import tempfile
+import threading
+import time
+from callgraph import CallGraph
+from collections import Counter
+from instrument import profiler
+from storage import dump_yaml, iter_results, load_yaml, write_results
 
 
 DIFFKEMP_OUT_FILENAME = "diffkemp-out.yaml"
+PROVENANCE_FILENAME = "provenance.yml"
+JOURNAL_FILENAME = "journal.jsonl"
+TIMINGS_FILENAME = "timings.yml"
+SNAPSHOT_FILENAME = "snapshot.yaml"
+# Names of the outputs of comparisons of multiple functions, which cannot
+# clash with the outputs of single functions named after them
+BATCH_DIRNAME = "@batch"
+FILTERED_DIRNAME = "@snapshots"
+UNKNOWN_SUFFIX = ": unknown"
+
+# Changed files which do not influence the compared functions, unless given
+# by the prune-ignore field of the configuration
+PRUNE_IGNORE = [
+    "*.md",
+    "*.rst",
+    "AUTHORS*",
+    "ChangeLog*",
+    "NEWS*",
+    "README*",
+    "doc/*",
+    "docs/*",
+]
 
 
 class DiffType(enum.StrEnum):
@@ -14,13 +46,15 @@ class DiffType(enum.StrEnum):
     SYNTACTIC = enum.auto()
     SEMANTIC = enum.auto()
     UNKNOWN = enum.auto()
+    TIMEOUT = enum.auto()
 
 
 class ComparisonResults:
     """Class for dealing with project comparison results."""
 
-    def __init__(self, results={}):
-        self.results = results
+    def __init__(self, results=None):
+        self.results = results if results is not None else {}
+        self.lock = threading.Lock()
 
     @staticmethod
     def key(old_tag, new_tag):
@@ -29,31 +63,266 @@ class ComparisonResults:
 
     def add(self, old_tag, new_tag, tag_results):
         """Add comparison between two tags to the results."""
-        self.results[self.key(old_tag, new_tag)] = tag_results
+        with self.lock:
+            self.results[self.key(old_tag, new_tag)] = tag_results
 
     def get(self, old_tag, new_tag):
         """Get comparison between two tags from the results."""
         return self.results[self.key(old_tag, new_tag)]
 
+    def sort(self, tag_pairs):
+        """Order the results according to the given list of tag pairs."""
+        with self.lock:
+            keys = [self.key(old_tag, new_tag) for old_tag, new_tag in tag_pairs]
+            ordered = {key: self.results[key] for key in keys if key in self.results}
+            ordered.update(self.results)
+            self.results = ordered
+
     @classmethod
     def load(cls, results_file):
-        """Load results from a file."""
-        with open(results_file, "r") as res_file:
-            results = yaml.safe_load(res_file)
-        return cls(results)
+        """Load results from a file in any of the supported formats."""
+        return cls(dict(iter_results(results_file)))
+
+    def dump(self, results_file):
+        """
+        Export the results to a file, in the format given by its extension,
+        one comparison at a time.
+        """
+        with self.lock:
+            write_results(results_file, self.results.items())
 
     def get_stats(self):
         """Return statistics about the results."""
         stats = {}
         for tag_key, tag_results in self.results.items():
-            stats[tag_key] = {}
-            for diff_type in DiffType:
-                stats[tag_key][diff_type.value] = len(
-                    [x for x in tag_results.values() if x == diff_type.value]
-                )
+            counts = Counter(tag_results.values())
+            stats[tag_key] = {
+                diff_type.value: counts[diff_type.value] for diff_type in DiffType
+            }
         return stats
 
 
+class Provenance:
+    """
+    Class recording the settings under which the result of each function
+    in each comparison was computed.
+    """
+
+    def __init__(self, settings=None, results=None):
+        self.settings = settings if settings is not None else {}
+        self.results = results if results is not None else {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(settings):
+        """Compute a short identifier of the given settings."""
+        return hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode()
+        ).hexdigest()[:16]
+
+    def record(self, old_tag, new_tag, functions, settings):
+        """Record that the functions were compared using the given settings."""
+        digest = self.digest(settings)
+        key = ComparisonResults.key(old_tag, new_tag)
+        with self.lock:
+            self.settings[digest] = settings
+            tag_results = self.results.setdefault(key, {})
+            for function in functions:
+                tag_results[function] = digest
+
+    def outdated(self, old_tag, new_tag, functions, settings):
+        """
+        Return the functions which were not compared yet or which were
+        compared using different settings.
+        """
+        digest = self.digest(settings)
+        tag_results = self.results.get(ComparisonResults.key(old_tag, new_tag), {})
+        return [f for f in functions if tag_results.get(f) != digest]
+
+    @classmethod
+    def load(cls, provenance_file):
+        """Load the provenance from a file, return an empty one if missing."""
+        if not os.path.exists(provenance_file):
+            return cls()
+        with open(provenance_file, "r") as prov_file:
+            provenance = load_yaml(prov_file)
+        return cls(provenance["settings"], provenance["results"])
+
+    def dump(self, provenance_file):
+        """Export the provenance to a file."""
+        with open(provenance_file, "w") as prov_file:
+            dump_yaml({"settings": self.settings, "results": self.results}, prov_file)
+
+
+class Journal:
+    """
+    Append-only log of finished comparisons, which makes it possible to resume
+    an interrupted analysis without repeating the finished comparisons.
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+
+    def append(self, old_tag, new_tag, tag_results, functions, settings):
+        """Persist the results of a finished comparison."""
+        record = {
+            "old": old_tag,
+            "new": new_tag,
+            "results": tag_results,
+            "functions": functions,
+            "settings": settings,
+        }
+        with self.lock:
+            with open(self.journal_file, "a") as journal:
+                journal.write(json.dumps(record) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+
+    def replay(self, results, provenance):
+        """
+        Add the results of all logged comparisons to the given results and
+        provenance. Return the number of replayed comparisons.
+        """
+        if not os.path.exists(self.journal_file):
+            return 0
+        replayed = 0
+        with open(self.journal_file, "r") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last record may be incomplete after a crash
+                    continue
+                results.add(record["old"], record["new"], record["results"])
+                provenance.record(
+                    record["old"],
+                    record["new"],
+                    record["functions"],
+                    record["settings"],
+                )
+                replayed += 1
+        return replayed
+
+    def clear(self):
+        """Remove the journal."""
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+
+
+class FunctionTimings:
+    """
+    Class recording how long the comparison of each function took, so that
+    later runs can balance the work among parallel diffkemp invocations.
+    """
+
+    def __init__(self, timings=None):
+        self.previous = timings if timings is not None else {}
+        self.current = {}
+        self.lock = threading.Lock()
+
+    def record(self, function, seconds):
+        """Record a comparison time, keeping the longest one of this run."""
+        with self.lock:
+            self.current[function] = max(self.current.get(function, 0.0), seconds)
+
+    def estimate(self, function):
+        """
+        Estimate the comparison time of a function. Functions which were never
+        compared separately are expected to take the average time.
+        """
+        return self.estimates([function])[0]
+
+    def estimates(self, functions):
+        """Estimate the comparison times of multiple functions at once."""
+        with self.lock:
+            known = {**self.previous, **self.current}
+        average = sum(known.values()) / len(known) if known else 1.0
+        return [known.get(function, average) for function in functions]
+
+    def slowest_first(self, functions):
+        """Sort functions from the one expected to take the longest."""
+        estimates = self.estimates(functions)
+        order = sorted(range(len(functions)), key=estimates.__getitem__, reverse=True)
+        return [functions[index] for index in order]
+
+    @classmethod
+    def load(cls, timings_file):
+        """Load the timings from a file, return empty timings if missing."""
+        if not os.path.exists(timings_file):
+            return cls()
+        with open(timings_file, "r") as t_file:
+            return cls(load_yaml(t_file))
+
+    def dump(self, timings_file):
+        """Export the timings of this and previous runs to a file."""
+        with self.lock:
+            timings = dict(self.previous)
+            timings.update(self.current)
+        with open(timings_file, "w") as t_file:
+            dump_yaml(timings, t_file)
+
+
+def merge_diffkemp_outputs(target_dir, source_dirs, functions):
+    """
+    Merge DiffKemp output directories into the target output directory,
+    replacing any previous results of the given functions.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    target_file = os.path.join(target_dir, DIFFKEMP_OUT_FILENAME)
+    merged = {"results": [], "definitions": {}}
+    if os.path.exists(target_file):
+        with open(target_file, "r") as out_file:
+            merged = load_yaml(out_file)
+    merged["results"] = [
+        result for result in merged["results"] if result["function"] not in functions
+    ]
+    for function in functions:
+        diff_file = os.path.join(target_dir, f"{function}.diff")
+        if os.path.exists(diff_file):
+            os.remove(diff_file)
+
+    for source_dir in source_dirs:
+        with open(os.path.join(source_dir, DIFFKEMP_OUT_FILENAME), "r") as out_file:
+            source_out = load_yaml(out_file)
+        merged["results"].extend(source_out["results"])
+        merged["definitions"].update(source_out["definitions"])
+        for file in os.listdir(source_dir):
+            if file.endswith(".diff"):
+                shutil.copy(os.path.join(source_dir, file), target_dir)
+
+    with open(target_file, "w") as out_file:
+        dump_yaml(merged, out_file)
+
+
+def filter_snapshot(snapshot_dir, functions, filtered_dir):
+    """
+    Create a snapshot restricted to the given functions in filtered_dir. It
+    shares all files except the function list with the original snapshot.
+    Return False if the function list of the snapshot has an unknown format.
+    """
+    with open(os.path.join(snapshot_dir, SNAPSHOT_FILENAME), "r") as snapshot_file:
+        snapshot = load_yaml(snapshot_file)
+    functions = set(functions)
+    try:
+        for group in snapshot:
+            group["list"] = [
+                entry for entry in group["list"] if entry["name"] in functions
+            ]
+    except (KeyError, TypeError):
+        return False
+    os.makedirs(filtered_dir)
+    snapshot_dir = os.path.abspath(snapshot_dir)
+    for file in os.listdir(snapshot_dir):
+        if file != SNAPSHOT_FILENAME:
+            os.symlink(
+                os.path.join(snapshot_dir, file), os.path.join(filtered_dir, file)
+            )
+    with open(os.path.join(filtered_dir, SNAPSHOT_FILENAME), "w") as snapshot_file:
+        dump_yaml(snapshot, snapshot_file)
+    return True
+
+
 class Comparator:
     """Class for comparing project snapshots."""
 
@@ -66,24 +335,259 @@ class Comparator:
         output_dir,
         custom_patterns,
         disable_patterns,
+        diffkemp_version=None,
+        commits=None,
+        journal=None,
+        name=None,
+        pair_timeout=None,
+        function_timeout=None,
+        prune_source_dir=None,
     ):
         self.verbose = verbose
         self.diffkemp = diffkemp
+        self.config = config
         self.project_name = config["name"]
+        self.name = name or self.project_name
         self.snapshots_dir = snapshots_dir
         self.output_dir = output_dir
         self.custom_patterns = custom_patterns
         self.disable_patterns = disable_patterns
+        self.diffkemp_version = diffkemp_version
+        self.commits = commits if commits is not None else {}
+        self.journal = journal
+        self.pair_timeout = pair_timeout
+        # Functions compared separately get the pair budget unless set otherwise
+        self.function_timeout = function_timeout or pair_timeout
         self.functions = config["functions"]
         self.results = ComparisonResults()
+        self.previous_results = ComparisonResults()
+        self.provenance = Provenance()
+        self.timings = FunctionTimings()
+        # Repository used to prune functions depending only on unchanged files
+        self.prune_source_dir = prune_source_dir
+        self.pruned = {}
+        self.shards = {}
+        # Source files each compared function depends on, for each tag
+        self.source_files = {}
+        self.source_files_locks = {}
+        self.lock = threading.Lock()
 
-    def compare_snapshots(self, old_tag, new_tag):
-        """Compare a function across two snapshots using diffkemp."""
-        old_tag_dir = os.path.join(self.snapshots_dir, old_tag)
-        new_tag_dir = os.path.join(self.snapshots_dir, new_tag)
+    def get_disable_patterns(self):
+        """Return the list of built-in patterns to disable."""
+        if not self.disable_patterns:
+            return []
+        return [pattern.strip() for pattern in self.disable_patterns.split(",")]
 
-        os.makedirs(self.output_dir, exist_ok=True)
-        diffkemp_out_dir = os.path.join(self.output_dir, f"{old_tag}-{new_tag}")
+    def get_settings(self, old_tag, new_tag):
+        """
+        Return the settings which influence the comparison of two tags. The
+        list of compared functions is deliberately not a part of them.
+        """
+        custom_patterns = None
+        if self.custom_patterns:
+            with open(self.custom_patterns, "rb") as patterns_file:
+                custom_patterns = hashlib.sha256(patterns_file.read()).hexdigest()
+        return {
+            "diffkemp": self.diffkemp_version,
+            "old-commit": self.commits.get(old_tag),
+            "new-commit": self.commits.get(new_tag),
+            "build": {
+                field: self.config.get(field)
+                for field in ["config-commands", "clang-append", "target"]
+            },
+            "custom-patterns": custom_patterns,
+            "disable-patterns": sorted(self.get_disable_patterns()),
+        }
+
+    def load_previous(self, results, provenance):
+        """Use previously computed results for incremental comparison."""
+        self.previous_results = results
+        self.provenance = provenance
+
+    def outdated_functions(self, old_tag, new_tag):
+        """
+        Return the functions whose previous results of the comparison of two
+        tags are missing or were computed using different settings. Timed out
+        functions are compared again if the time budget was raised since.
+        """
+        key = ComparisonResults.key(old_tag, new_tag)
+        previous = self.previous_results.results.get(key, {})
+        outdated = set(
+            self.provenance.outdated(
+                old_tag, new_tag, self.functions, self.get_settings(old_tag, new_tag)
+            )
+        )
+        for function, result in previous.items():
+            if result == DiffType.TIMEOUT.value and (
+                self.function_timeout is None
+                or self.timings.estimate(function) < self.function_timeout
+            ):
+                outdated.add(function)
+        return [f for f in self.functions if f in outdated or f not in previous]
+
+    def get_source_files(self, tag):
+        """
+        Return the source files each compared function depends on in the
+        snapshot of a tag. The call graph of each snapshot is loaded once and
+        dropped right after, snapshots of different tags load in parallel.
+        """
+        with self.lock:
+            tag_lock = self.source_files_locks.setdefault(tag, threading.Lock())
+        with tag_lock:
+            if tag not in self.source_files:
+                with profiler.stage("call-graph", tag=tag):
+                    call_graph = CallGraph.load(os.path.join(self.snapshots_dir, tag))
+                    self.source_files[tag] = {
+                        function: call_graph.source_files(function)
+                        for function in self.functions
+                    }
+            return self.source_files[tag]
+
+    def prune_unchanged(self, old_tag, new_tag, functions):
+        """
+        Classify the functions which neither themselves nor through any symbol
+        they transitively reference depend on a file changed between the tags
+        as equal without comparing them. The references are taken from the
+        LLVM IR of both snapshots. Return the functions which still need to
+        be compared. All functions are kept if files other than C sources
+        changed, and a function is kept if it is missing in a snapshot.
+        """
+        changed = profiler.run(
+            [
+                "git",
+                "diff",
+                "--name-only",
+                "--no-renames",
+                "-z",
+                self.commits.get(old_tag, old_tag),
+                self.commits.get(new_tag, new_tag),
+            ],
+            cwd=self.prune_source_dir,
+            stdout=subprocess.PIPE,
+        )
+        ignored = self.config.get("prune-ignore", PRUNE_IGNORE)
+        changed_files = [
+            os.path.normpath(path)
+            for path in changed.decode(errors="surrogateescape").split("\0")
+            if path
+            and not any(
+                fnmatch.fnmatch(path, pattern)
+                or fnmatch.fnmatch(os.path.basename(path), pattern)
+                for pattern in ignored
+            )
+        ]
+        # Headers and build files may influence any function
+        if any(not path.endswith(".c") for path in changed_files):
+            return functions
+
+        source_files = [self.get_source_files(old_tag), self.get_source_files(new_tag)]
+
+        def is_unchanged(function):
+            files = set()
+            for tag_source_files in source_files:
+                function_files = tag_source_files[function]
+                if function_files is None:
+                    return False
+                files |= function_files
+            # Module paths may be absolute or relative to a subdirectory
+            return not any(
+                file == path
+                or file.endswith(f"/{path}")
+                or path.endswith(f"/{file}")
+                for file in files
+                for path in changed_files
+            )
+
+        pruned = [function for function in functions if is_unchanged(function)]
+        if not pruned:
+            return functions
+        print(
+            f"Classifying {len(pruned)} functions in {old_tag} and {new_tag} of "
+            f"{self.name} as equal, they do not depend on any changed file."
+        )
+        return self.mark_unchanged(old_tag, new_tag, functions, pruned)
+
+    def infer_unchanged(self, old_tag, new_tag, functions):
+        """
+        Classify the functions which are equal in all comparisons of
+        consecutive tags between the two tags as equal without comparing
+        them. The comparisons of consecutive tags must be finished already.
+        Return the functions which still need to be compared.
+        """
+        tags = self.config["tags"]
+        first, last = sorted([tags.index(old_tag), tags.index(new_tag)])
+        if last - first < 2:
+            return functions
+        chain = [
+            self.results.results.get(ComparisonResults.key(tags[i], tags[i + 1]))
+            for i in range(first, last)
+        ]
+        if any(tag_results is None for tag_results in chain):
+            return functions
+        inferred = [
+            function
+            for function in functions
+            if all(
+                tag_results.get(function) == DiffType.NO_DIFF.value
+                for tag_results in chain
+            )
+        ]
+        if not inferred:
+            return functions
+        print(
+            f"Classifying {len(inferred)} functions in {old_tag} and {new_tag} of "
+            f"{self.name} as equal, they are equal in all versions in between."
+        )
+        return self.mark_unchanged(old_tag, new_tag, functions, inferred)
+
+    def mark_unchanged(self, old_tag, new_tag, functions, unchanged):
+        """
+        Record the unchanged functions as equal in the comparison of two
+        tags. Return the other functions.
+        """
+        key = ComparisonResults.key(old_tag, new_tag)
+        with self.lock:
+            self.pruned.setdefault(key, {}).update(
+                dict.fromkeys(unchanged, DiffType.NO_DIFF.value)
+            )
+            # Drop the outputs of previous comparisons of the unchanged
+            # functions, shards of the same comparison may do so concurrently
+            diffkemp_out_dir = os.path.join(self.output_dir, f"{old_tag}-{new_tag}")
+            if os.path.isdir(diffkemp_out_dir):
+                merge_diffkemp_outputs(diffkemp_out_dir, [], unchanged)
+        self.provenance.record(
+            old_tag, new_tag, unchanged, self.get_settings(old_tag, new_tag)
+        )
+        unchanged = set(unchanged)
+        return [function for function in functions if function not in unchanged]
+
+    def reuse_results(self, old_tag, new_tag):
+        """Reuse the previous results of the comparison of two tags."""
+        key = ComparisonResults.key(old_tag, new_tag)
+        previous = {
+            **self.previous_results.results.get(key, {}),
+            **self.pruned.get(key, {}),
+        }
+        self.results.add(old_tag, new_tag, {f: previous[f] for f in self.functions})
+
+    def run_compare(
+        self,
+        old_tag,
+        new_tag,
+        diffkemp_out_dir,
+        function=None,
+        timeout=None,
+        snapshots_dir=None,
+    ):
+        """
+        Run diffkemp compare on two snapshots, optionally restricted to a single
+        function or taken from another directory of snapshots. Return the
+        standard output of DiffKemp and its YAML output. Raise
+        subprocess.TimeoutExpired if DiffKemp exceeds the timeout.
+        """
+        snapshots_dir = snapshots_dir or self.snapshots_dir
+        old_tag_dir = os.path.join(snapshots_dir, old_tag)
+        new_tag_dir = os.path.join(snapshots_dir, new_tag)
         shutil.rmtree(diffkemp_out_dir, ignore_errors=True)
 
         # Run diffkemp compare
@@ -97,43 +601,288 @@ class Comparator:
             diffkemp_out_dir,
         ]
 
+        if function is not None:
+            compare_command.extend(["--function", function])
+
         if self.custom_patterns:
             compare_command.extend(["--custom-patterns", self.custom_patterns])
 
-        if self.disable_patterns:
-            disable_patterns_list = [
-                pattern.strip() for pattern in self.disable_patterns.split(",")
-            ]
-            disable_patterns_opt = map(
-                lambda x: f"--disable-pattern={x}", disable_patterns_list
-            )
-            compare_command.extend(disable_patterns_opt)
+        compare_command.extend(
+            map(lambda x: f"--disable-pattern={x}", self.get_disable_patterns())
+        )
 
-        print(f"Comparing {old_tag} and {new_tag} of {self.project_name}.")
         if self.verbose:
             print(" ".join(compare_command))
 
-        compare_result = subprocess.check_output(compare_command)
+        compare_result = profiler.run(
+            compare_command, stdout=subprocess.PIPE, timeout=timeout
+        )
 
         # Load the yaml output
-        with open(
+        with profiler.stage("parse"), open(
             os.path.join(diffkemp_out_dir, DIFFKEMP_OUT_FILENAME), "r"
         ) as res_file:
-            diffkemp_out = yaml.safe_load(res_file)
+            diffkemp_out = load_yaml(res_file)
+
+        return compare_result, diffkemp_out
+
+    @staticmethod
+    def classify(functions, compare_result, diffkemp_out, diffkemp_out_dir):
+        """Classify the results of compared functions."""
+        # Index all outputs first so that each function is classified in O(1)
+        unknown_functions = set()
+        for line in compare_result.decode().splitlines():
+            line = line.strip()
+            if line.endswith(UNKNOWN_SUFFIX):
+                unknown_functions.add(line[: -len(UNKNOWN_SUFFIX)])
+        semantic_functions = {
+            result["function"] for result in diffkemp_out["results"]
+        }
+        diff_files = set(os.listdir(diffkemp_out_dir))
 
         tag_results = {}
-        for function in self.functions:
-            if f"{function}: unknown" in compare_result.decode():
+        for function in functions:
+            if function in unknown_functions:
                 diff_type = DiffType.UNKNOWN
-            elif function in map(lambda x: x["function"], diffkemp_out["results"]):
+            elif function in semantic_functions:
                 diff_type = DiffType.SEMANTIC
-            elif f"{function}.diff" in os.listdir(diffkemp_out_dir):
+            elif f"{function}.diff" in diff_files:
                 diff_type = DiffType.SYNTACTIC
             else:
                 diff_type = DiffType.NO_DIFF
             tag_results[function] = diff_type.value
+        return tag_results
+
+    def compare_functions(self, old_tag, new_tag, functions, out_dir):
+        """
+        Compare each of the given functions using a separate diffkemp
+        invocation, storing the outputs into subdirectories of out_dir. The
+        functions expected to take the longest are compared first. Functions
+        exceeding the time budget are classified as timed out. Return the
+        classified results and the list of the output directories.
+        """
+        tag_results = {}
+        function_out_dirs = []
+        for function in self.timings.slowest_first(list(functions)):
+            function_out_dir = os.path.join(out_dir, function)
+            start = time.perf_counter()
+            try:
+                compare_result, diffkemp_out = self.run_compare(
+                    old_tag,
+                    new_tag,
+                    function_out_dir,
+                    function,
+                    timeout=self.function_timeout,
+                )
+            except subprocess.TimeoutExpired:
+                print(
+                    f"Comparison of {function} in {old_tag} and {new_tag} of "
+                    f"{self.name} timed out after {self.function_timeout} s."
+                )
+                self.timings.record(function, time.perf_counter() - start)
+                tag_results[function] = DiffType.TIMEOUT.value
+                shutil.rmtree(function_out_dir, ignore_errors=True)
+                continue
+            self.timings.record(function, time.perf_counter() - start)
+            with profiler.stage("classify"):
+                tag_results.update(
+                    self.classify(
+                        [function], compare_result, diffkemp_out, function_out_dir
+                    )
+                )
+            function_out_dirs.append(function_out_dir)
+        return tag_results, function_out_dirs
 
+    def compare_batch(self, old_tag, new_tag, functions, out_dir):
+        """
+        Compare the given functions using a single diffkemp invocation on
+        snapshots restricted to them, storing the output into a subdirectory
+        of out_dir. The functions are compared separately if the snapshots
+        cannot be restricted or if the invocation exceeds the time budget of
+        the pair. Return the classified results and the output directories.
+        """
+        if not functions:
+            return {}, []
+        filtered_dir = os.path.join(out_dir, FILTERED_DIRNAME)
+        shutil.rmtree(filtered_dir, ignore_errors=True)
+        if not all(
+            filter_snapshot(
+                os.path.join(self.snapshots_dir, tag),
+                functions,
+                os.path.join(filtered_dir, tag),
+            )
+            for tag in [old_tag, new_tag]
+        ):
+            shutil.rmtree(filtered_dir, ignore_errors=True)
+            return self.compare_functions(old_tag, new_tag, functions, out_dir)
+
+        batch_out_dir = os.path.join(out_dir, BATCH_DIRNAME)
+        start = time.perf_counter()
+        try:
+            compare_result, diffkemp_out = self.run_compare(
+                old_tag,
+                new_tag,
+                batch_out_dir,
+                timeout=self.pair_timeout,
+                snapshots_dir=filtered_dir,
+            )
+        except subprocess.TimeoutExpired:
+            print(
+                f"Comparison of {len(functions)} functions in {old_tag} and "
+                f"{new_tag} of {self.name} timed out after {self.pair_timeout} s, "
+                "comparing them separately."
+            )
+            shutil.rmtree(batch_out_dir, ignore_errors=True)
+            shutil.rmtree(filtered_dir, ignore_errors=True)
+            return self.compare_functions(old_tag, new_tag, functions, out_dir)
+        shutil.rmtree(filtered_dir, ignore_errors=True)
+        # The time of each function is unknown, so it is split evenly
+        elapsed = time.perf_counter() - start
+        for function in functions:
+            self.timings.record(function, elapsed / len(functions))
+        with profiler.stage("classify"):
+            tag_results = self.classify(
+                functions, compare_result, diffkemp_out, batch_out_dir
+            )
+        return tag_results, [batch_out_dir]
+
+    def finish_comparison(self, old_tag, new_tag, compared, tag_results, out_dirs):
+        """
+        Merge the results and outputs of the compared functions with the
+        previous results of the comparison of two tags and record them.
+        """
+        diffkemp_out_dir = os.path.join(self.output_dir, f"{old_tag}-{new_tag}")
+        if out_dirs:
+            with profiler.stage("merge"):
+                merge_diffkemp_outputs(diffkemp_out_dir, out_dirs, compared)
+        elif not os.path.exists(os.path.join(diffkemp_out_dir, DIFFKEMP_OUT_FILENAME)):
+            # Every compared pair has an output, even if no function was compared
+            merge_diffkemp_outputs(diffkemp_out_dir, [], [])
+        key = ComparisonResults.key(old_tag, new_tag)
+        merged_results = dict(self.previous_results.results.get(key, {}))
+        merged_results.update(self.pruned.get(key, {}))
+        merged_results.update(tag_results)
+        tag_results = {f: merged_results[f] for f in self.functions}
+
+        settings = self.get_settings(old_tag, new_tag)
+        self.provenance.record(old_tag, new_tag, compared, settings)
         self.results.add(old_tag, new_tag, tag_results)
+        if self.journal is not None:
+            self.journal.append(old_tag, new_tag, tag_results, compared, settings)
+
+    def compare_snapshots(self, old_tag, new_tag, functions=None):
+        """
+        Compare functions across two snapshots using diffkemp. If a subset of
+        functions is given, only those are compared and the previous results
+        are reused for the rest. Functions equal in all versions in between
+        and, if pruning is enabled, functions not depending on any changed
+        file are not compared.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        diffkemp_out_dir = os.path.join(self.output_dir, f"{old_tag}-{new_tag}")
+        if functions is None:
+            functions = self.functions
+        functions = self.infer_unchanged(old_tag, new_tag, functions)
+        if functions and self.prune_source_dir is not None:
+            functions = self.prune_unchanged(old_tag, new_tag, functions)
+        if not functions:
+            self.finish_comparison(old_tag, new_tag, [], {}, [])
+            return
+
+        compare = self.compare_batch
+        if set(self.functions) <= set(functions):
+            print(f"Comparing {old_tag} and {new_tag} of {self.name}.")
+            try:
+                compare_result, diffkemp_out = self.run_compare(
+                    old_tag, new_tag, diffkemp_out_dir, timeout=self.pair_timeout
+                )
+            except subprocess.TimeoutExpired:
+                # Isolate the functions which take too long
+                print(
+                    f"Comparison of {old_tag} and {new_tag} of {self.name} timed "
+                    f"out after {self.pair_timeout} s, comparing functions "
+                    "separately."
+                )
+                shutil.rmtree(diffkemp_out_dir, ignore_errors=True)
+                functions = self.functions
+                compare = self.compare_functions
+            else:
+                with profiler.stage("classify"):
+                    tag_results = self.classify(
+                        self.functions, compare_result, diffkemp_out, diffkemp_out_dir
+                    )
+                self.finish_comparison(
+                    old_tag, new_tag, self.functions, tag_results, []
+                )
+                return
+
+        print(
+            f"Comparing {len(functions)} functions in {old_tag} and {new_tag} "
+            f"of {self.name}."
+        )
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as tmp_dir:
+            tag_results, out_dirs = compare(old_tag, new_tag, functions, tmp_dir)
+            self.finish_comparison(old_tag, new_tag, functions, tag_results, out_dirs)
+
+    def estimate(self, functions):
+        """Estimate the time of comparing the given functions separately."""
+        return sum(self.timings.estimates(list(functions)))
+
+    def partition(self, functions, shards):
+        """
+        Split functions into at most the given number of shards with similar
+        expected comparison times, using the timings of previous runs.
+        """
+        loads = [(0.0, i) for i in range(min(shards, len(functions)))]
+        partition = [[] for _ in loads]
+        # Assign the slowest functions first, always to the least loaded shard
+        functions = list(functions)
+        estimates = dict(zip(functions, self.timings.estimates(functions)))
+        for function in self.timings.slowest_first(functions):
+            load, i = heapq.heappop(loads)
+            partition[i].append(function)
+            heapq.heappush(loads, (load + estimates[function], i))
+        return partition
+
+    def shard_dir(self, old_tag, new_tag, index):
+        """Return the output directory of a shard of a comparison."""
+        return os.path.join(self.output_dir, f"{old_tag}-{new_tag}.shard{index}")
+
+    def compare_shard(self, old_tag, new_tag, index, functions):
+        """
+        Compare a shard of functions across two snapshots using a single
+        diffkemp invocation if possible.
+        """
+        functions = self.infer_unchanged(old_tag, new_tag, functions)
+        if functions and self.prune_source_dir is not None:
+            functions = self.prune_unchanged(old_tag, new_tag, functions)
+        print(
+            f"Comparing shard {index + 1} ({len(functions)} functions) of {old_tag} "
+            f"and {new_tag} of {self.name}."
+        )
+        shard_dir = self.shard_dir(old_tag, new_tag, index)
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        tag_results, out_dirs = self.compare_batch(
+            old_tag, new_tag, functions, shard_dir
+        )
+        with self.lock:
+            self.shards.setdefault((old_tag, new_tag), {})[index] = (
+                tag_results,
+                out_dirs,
+            )
+
+    def merge_shards(self, old_tag, new_tag, functions):
+        """Merge the results and outputs of all shards of a comparison."""
+        with self.lock:
+            shards = self.shards.pop((old_tag, new_tag))
+        tag_results = {}
+        out_dirs = []
+        for shard_results, shard_out_dirs in shards.values():
+            tag_results.update(shard_results)
+            out_dirs.extend(shard_out_dirs)
+        self.finish_comparison(old_tag, new_tag, functions, tag_results, out_dirs)
+        for index in shards:
+            shutil.rmtree(self.shard_dir(old_tag, new_tag, index), ignore_errors=True)
 
     def get_results(self):
         """Return the results object."""
@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sys
+from storage import iter_results, write_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert a results file from analyze.py between the YAML "
+        "(.yml) and the line-delimited JSON (.jsonl) format."
+    )
+    parser.add_argument(
+        "input",
+        help="path to the results file to convert",
+    )
+    parser.add_argument(
+        "output",
+        help="path to the converted results file, the format is given by its "
+        "extension",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"File {args.input} does not exist.")
+        sys.exit(1)
+
+    # The results are converted one comparison at a time
+    write_results(args.output, iter_results(args.input))
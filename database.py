@@ -0,0 +1,318 @@
+import json
+import os
+import sqlite3
+from compare import (
+    DIFFKEMP_OUT_FILENAME,
+    PROVENANCE_FILENAME,
+    TIMINGS_FILENAME,
+    Provenance,
+)
+from storage import YAML_FORMAT, find_results_file, iter_results, load_yaml
+
+SEMANTIC_TEMPLATE_FILENAME = "template-semantic.yml"
+SYNTACTIC_TEMPLATE_FILENAME = "template-syntactic.yml"
+REVIEW_FILES = {
+    "semantic": SEMANTIC_TEMPLATE_FILENAME,
+    "syntactic": SYNTACTIC_TEMPLATE_FILENAME,
+}
+KEY_SEPARATOR = " -> "
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    old_tag TEXT NOT NULL,
+    new_tag TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    UNIQUE (project_id, old_tag, new_tag)
+);
+CREATE TABLE IF NOT EXISTS functions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS settings (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    digest TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    PRIMARY KEY (project_id, digest)
+);
+CREATE TABLE IF NOT EXISTS results (
+    pair_id INTEGER NOT NULL REFERENCES pairs(id) ON DELETE CASCADE,
+    function_id INTEGER NOT NULL REFERENCES functions(id),
+    diff_type TEXT NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (pair_id, function_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_function ON results (function_id);
+CREATE INDEX IF NOT EXISTS results_diff_type ON results (diff_type, function_id);
+CREATE TABLE IF NOT EXISTS stats (
+    pair_id INTEGER NOT NULL REFERENCES pairs(id) ON DELETE CASCADE,
+    diff_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (pair_id, diff_type)
+);
+CREATE TABLE IF NOT EXISTS diffs (
+    pair_id INTEGER NOT NULL REFERENCES pairs(id) ON DELETE CASCADE,
+    function_id INTEGER NOT NULL REFERENCES functions(id),
+    diff_function_id INTEGER NOT NULL REFERENCES functions(id),
+    PRIMARY KEY (pair_id, function_id, diff_function_id)
+);
+CREATE INDEX IF NOT EXISTS diffs_diff_function ON diffs (diff_function_id);
+CREATE TABLE IF NOT EXISTS definitions (
+    pair_id INTEGER NOT NULL REFERENCES pairs(id) ON DELETE CASCADE,
+    function_id INTEGER NOT NULL REFERENCES functions(id),
+    file TEXT,
+    line INTEGER,
+    PRIMARY KEY (pair_id, function_id)
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    pair_id INTEGER NOT NULL REFERENCES pairs(id) ON DELETE CASCADE,
+    function_id INTEGER NOT NULL REFERENCES functions(id),
+    kind TEXT NOT NULL,
+    category TEXT,
+    comment TEXT,
+    PRIMARY KEY (pair_id, function_id, kind)
+);
+CREATE INDEX IF NOT EXISTS reviews_category ON reviews (kind, category);
+CREATE TABLE IF NOT EXISTS timings (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    function_id INTEGER NOT NULL REFERENCES functions(id),
+    seconds REAL NOT NULL,
+    PRIMARY KEY (project_id, function_id)
+);
+CREATE VIEW IF NOT EXISTS function_results AS
+SELECT projects.name AS project, pairs.old_tag, pairs.new_tag,
+    functions.name AS function, results.diff_type, results.digest,
+    semantic.category AS semantic_category,
+    syntactic.category AS syntactic_category
+FROM results
+JOIN pairs ON pairs.id = results.pair_id
+JOIN projects ON projects.id = pairs.project_id
+JOIN functions ON functions.id = results.function_id
+LEFT JOIN reviews AS semantic ON semantic.pair_id = results.pair_id
+    AND semantic.function_id = results.function_id AND semantic.kind = 'semantic'
+LEFT JOIN reviews AS syntactic ON syntactic.pair_id = results.pair_id
+    AND syntactic.function_id = results.function_id AND syntactic.kind = 'syntactic';
+"""
+
+
+def split_key(key):
+    """Split a key of the results dictionary into the two compared tags."""
+    old_tag, _, new_tag = key.partition(KEY_SEPARATOR)
+    return old_tag, new_tag
+
+
+class ResultsDatabase:
+    """
+    Indexed SQLite store of the results of analyses of multiple projects,
+    including the reviews, the comparison times and the settings used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+        self.function_ids = {
+            name: function_id
+            for function_id, name in self.connection.execute(
+                "SELECT id, name FROM functions"
+            )
+        }
+
+    def close(self):
+        """Close the connection to the database."""
+        self.connection.close()
+
+    def function_id(self, function):
+        """Return the identifier of a function, adding the function if needed."""
+        if function not in self.function_ids:
+            cursor = self.connection.execute(
+                "INSERT INTO functions (name) VALUES (?)", (function,)
+            )
+            self.function_ids[function] = cursor.lastrowid
+        return self.function_ids[function]
+
+    def import_project(self, project_name, project_dir):
+        """
+        Import the results of a project from its output directory, replacing
+        any previously imported results of the project. Return the number of
+        imported results.
+        """
+        results_file = find_results_file(project_dir, YAML_FORMAT)
+        if results_file is None:
+            raise FileNotFoundError(f"No results found in {project_dir}")
+        provenance = Provenance.load(os.path.join(project_dir, PROVENANCE_FILENAME))
+        imported = 0
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM projects WHERE name = ?", (project_name,)
+            )
+            project_id = self.connection.execute(
+                "INSERT INTO projects (name) VALUES (?)", (project_name,)
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO settings VALUES (?, ?, ?)",
+                (
+                    (project_id, digest, json.dumps(settings, sort_keys=True))
+                    for digest, settings in provenance.settings.items()
+                ),
+            )
+
+            pair_ids = {}
+            for position, (key, tag_results) in enumerate(iter_results(results_file)):
+                old_tag, new_tag = split_key(key)
+                pair_id = self.connection.execute(
+                    "INSERT INTO pairs (project_id, old_tag, new_tag, position) "
+                    "VALUES (?, ?, ?, ?)",
+                    (project_id, old_tag, new_tag, position),
+                ).lastrowid
+                pair_ids[key] = pair_id
+                digests = provenance.results.get(key, {})
+                self.connection.executemany(
+                    "INSERT INTO results VALUES (?, ?, ?, ?)",
+                    (
+                        (pair_id, self.function_id(f), result, digests.get(f))
+                        for f, result in tag_results.items()
+                    ),
+                )
+                self.connection.execute(
+                    "INSERT INTO stats SELECT pair_id, diff_type, COUNT(*) "
+                    "FROM results WHERE pair_id = ? GROUP BY diff_type",
+                    (pair_id,),
+                )
+                imported += len(tag_results)
+                self.import_diffkemp_out(
+                    pair_id, os.path.join(project_dir, f"{old_tag}-{new_tag}")
+                )
+
+            for kind, filename in REVIEW_FILES.items():
+                self.import_reviews(
+                    pair_ids, kind, os.path.join(project_dir, filename)
+                )
+
+            timings_file = os.path.join(project_dir, TIMINGS_FILENAME)
+            if os.path.exists(timings_file):
+                with open(timings_file, "r") as t_file:
+                    timings = load_yaml(t_file) or {}
+                self.connection.executemany(
+                    "INSERT INTO timings VALUES (?, ?, ?)",
+                    (
+                        (project_id, self.function_id(f), seconds)
+                        for f, seconds in timings.items()
+                    ),
+                )
+        return imported
+
+    def import_diffkemp_out(self, pair_id, diffkemp_out_dir):
+        """Import the differing functions and the definitions of a comparison."""
+        diffkemp_out_file = os.path.join(diffkemp_out_dir, DIFFKEMP_OUT_FILENAME)
+        if not os.path.exists(diffkemp_out_file):
+            return
+        with open(diffkemp_out_file, "r") as out_file:
+            diffkemp_out = load_yaml(out_file) or {}
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO diffs VALUES (?, ?, ?)",
+            (
+                (
+                    pair_id,
+                    self.function_id(result["function"]),
+                    self.function_id(diff["function"]),
+                )
+                for result in diffkemp_out.get("results") or []
+                for diff in result["diffs"]
+            ),
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO definitions VALUES (?, ?, ?, ?)",
+            (
+                (
+                    pair_id,
+                    self.function_id(function),
+                    definition["new"].get("file"),
+                    definition["new"].get("line"),
+                )
+                for function, definition in (
+                    diffkemp_out.get("definitions") or {}
+                ).items()
+                if "new" in definition
+            ),
+        )
+
+    def import_reviews(self, pair_ids, kind, review_file):
+        """Import the categories and comments of a (filled) review template."""
+        if not os.path.exists(review_file):
+            return
+        with open(review_file, "r") as r_file:
+            review = load_yaml(r_file) or {}
+        self.connection.executemany(
+            "INSERT INTO reviews VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    pair_ids[key],
+                    self.function_id(function),
+                    kind,
+                    function_review.get("category") or None,
+                    function_review.get("comment") or None,
+                )
+                for key, tag_review in review.items()
+                if key in pair_ids
+                for function, function_review in (tag_review or {}).items()
+            ),
+        )
+
+    def query(self, project=None, function=None, diff_type=None, category=None):
+        """
+        Return the results matching all given conditions as tuples of the
+        project, the compared tags, the function, the kind of the result and
+        the review category.
+        """
+        conditions = []
+        parameters = []
+        for column, value in [
+            ("project", project),
+            ("function", function),
+            ("diff_type", diff_type),
+        ]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if category is not None:
+            conditions.append("(semantic_category = ? OR syntactic_category = ?)")
+            parameters.extend([category, category])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.connection.execute(
+            "SELECT project, old_tag, new_tag, function, diff_type, "
+            "COALESCE(semantic_category, syntactic_category) "
+            f"FROM function_results {where} "
+            "ORDER BY project, old_tag, new_tag, function",
+            parameters,
+        ).fetchall()
+
+    def get_stats(self, project=None):
+        """
+        Return the numbers of results of each kind in each comparison as
+        tuples of the project, the compared tags, the kind and the count.
+        """
+        where = "WHERE projects.name = ?" if project is not None else ""
+        return self.connection.execute(
+            "SELECT projects.name, pairs.old_tag, pairs.new_tag, "
+            "stats.diff_type, stats.count "
+            "FROM stats "
+            "JOIN pairs ON pairs.id = stats.pair_id "
+            "JOIN projects ON projects.id = pairs.project_id "
+            f"{where} "
+            "ORDER BY projects.name, pairs.position, stats.diff_type",
+            [project] if project is not None else [],
+        ).fetchall()
+
+    def execute(self, sql):
+        """Run an SQL query and return the names of the columns and the rows."""
+        cursor = self.connection.execute(sql)
+        columns = [column[0] for column in cursor.description or []]
+        return columns, cursor.fetchall()
@@ -2,70 +2,133 @@
 
 import sys
 import os
-import yaml
 import argparse
+from collections import Counter
+from contextlib import ExitStack
+from storage import IndexedResults, dump_yaml, write_results
+
+MISSING = "missing"
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description="Obtain a difference between two results files from analyze.py."
+        description="Obtain a difference between results files from analyze.py. "
+        "The first file is the baseline to which the other files are compared."
     )
     parser.add_argument(
-        "first",
-        help="path to the first results file",
+        "results",
+        nargs="+",
+        help="paths to the results files",
     )
     parser.add_argument(
-        "second",
-        help="path to the second results file",
+        "--labels",
+        help="comma-separated labels of the results files, 'first' and 'second' "
+        "by default for two files and the paths to the files otherwise",
     )
     parser.add_argument(
         "--output",
         default="diff.yml",
-        help="path to the file where the diff will be stored",
+        help="path to the file where the diff will be stored, the diff is stored "
+        "as line-delimited JSON if the path ends with .jsonl",
+    )
+    parser.add_argument(
+        "--counts",
+        help="path to the file where the numbers of changes of each kind from "
+        "the baseline will be stored",
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if len(args.results) < 2:
+        parser.error("at least two results files are required")
+    return args
+
+
+def get_labels(args):
+    """Return the labels of the compared results files."""
+    if args.labels is not None:
+        labels = args.labels.split(",")
+        if len(labels) != len(args.results):
+            print("The number of labels does not match the number of files.")
+            sys.exit(1)
+        return labels
+    if len(args.results) == 2:
+        return ["first", "second"]
+    return args.results
+
+
+def diff_pair(labels, pair_results):
+    """
+    Compare the results of a single comparison from all files. Return the
+    differing functions with the result from each file and a counter of the
+    changes from the baseline. Files missing the comparison are left out and
+    nothing is compared if the baseline is missing it.
+    """
+    changes = {label: Counter() for label in labels[1:]}
+    present = [
+        (label, tag_results)
+        for label, tag_results in zip(labels, pair_results)
+        if tag_results is not None
+    ]
+    if pair_results[0] is None or len(present) < 2:
+        return {}, changes
+    functions = {}
+    for _, tag_results in present:
+        functions.update(dict.fromkeys(tag_results))
+    diff = {}
+    for function in functions:
+        row = [tag_results.get(function, MISSING) for _, tag_results in present]
+        if all(result == row[0] for result in row):
+            continue
+        diff[function] = {label: result for (label, _), result in zip(present, row)}
+        for (label, _), result in zip(present[1:], row[1:]):
+            if result != row[0]:
+                changes[label][f"{row[0]} -> {result}"] += 1
+    return diff, changes
 
 
 if __name__ == "__main__":
     args = parse_args()
+    labels = get_labels(args)
+
+    for path in args.results:
+        if not os.path.exists(path):
+            print(f"File {path} does not exist.")
+            sys.exit(1)
+
+    for path in [args.output, args.counts]:
+        results_dir = os.path.dirname(path) if path else None
+        if results_dir and not os.path.exists(results_dir):
+            os.makedirs(results_dir, exist_ok=True)
+
+    counts = {}
+    total = {label: Counter() for label in labels[1:]}
+    with ExitStack() as stack:
+        files = [stack.enter_context(IndexedResults(path)) for path in args.results]
+        keys = list(dict.fromkeys(key for file in files for key in file.keys()))
+        for key in keys:
+            missing = [
+                label for label, file in zip(labels, files) if key not in file.index
+            ]
+            if missing:
+                print(f"Comparison {key} is missing in: {', '.join(missing)}.")
+
+        def diff_pairs():
+            # Only the results of a single comparison are loaded at once
+            for key in keys:
+                diff, changes = diff_pair(labels, [file.get(key) for file in files])
+                counts[key] = {label: dict(changes[label]) for label in labels[1:]}
+                for label in labels[1:]:
+                    total[label].update(changes[label])
+                if diff:
+                    yield key, diff
+
+        write_results(args.output, diff_pairs())
 
-    if not os.path.exists(args.first):
-        print(f"File {args.first} does not exist.")
-        sys.exit(1)
-    if not os.path.exists(args.second):
-        print(f"File {args.second} does not exist.")
-        sys.exit(1)
-
-    with open(args.first, "r") as first_file:
-        first = yaml.safe_load(first_file)
-    with open(args.second, "r") as second_file:
-        second = yaml.safe_load(second_file)
-
-    if first.keys() != second.keys():
-        print("The two files do not contain the same release comparisons.")
-        sys.exit(1)
-
-    if not all(
-        first[release].keys() == second[release].keys() for release in first.keys()
-    ):
-        print("The two files do not contain the same function comparisons.")
-        sys.exit(1)
-
-    output = {}
-    for release, functions in first.items():
-        release_output = {}
-        for function, result in functions.items():
-            if result != second[release][function]:
-                release_output[function] = {
-                    "first": result,
-                    "second": second[release][function],
-                }
-        if release_output:
-            output[release] = release_output
-
-    results_dir = os.path.dirname(args.output)
-    if results_dir and not os.path.exists(results_dir):
-        os.makedirs(results_dir, exist_ok=True)
-
-    with open(args.output, "w") as output_file:
-        yaml.safe_dump(output, output_file)
+    counts["total"] = {label: dict(total[label]) for label in labels[1:]}
+    for label in labels[1:]:
+        changed = total[label].total()
+        print(f"{label}: {changed} changed classifications")
+        for change, count in total[label].most_common():
+            print(f"  {change}: {count}")
+    if args.counts is not None:
+        with open(args.counts, "w") as counts_file:
+            dump_yaml(counts, counts_file)
@@ -0,0 +1,277 @@
+import atexit
+import json
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_FILENAME = "profile.json"
+TRACE_FILENAME = "trace.json"
+
+# Resource usage of the calling thread is available only on Linux
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+# Blocks in the rusage counters are always 512 bytes large
+BLOCK_SIZE = 512
+# The maximum resident set size is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if os.uname().sysname == "Darwin" else 1024
+
+
+def command_name(command):
+    """Return a short name of a command, e.g., "git clone"."""
+    if isinstance(command, str):
+        return "shell"
+    name = os.path.basename(command[0])
+    if len(command) > 1 and not command[1].startswith("-"):
+        name += f" {command[1]}"
+    return name
+
+
+class Profiler:
+    """
+    Class recording the wall time, the CPU time, the peak memory usage and
+    the number of written bytes of stages of the analysis and of all
+    subprocesses they run. Stages can be nested, and each event is labeled
+    by the labels of all enclosing stages of the same thread (e.g., the
+    project and the tag).
+    """
+
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter()
+        self.threads = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Process groups of the running commands with a timeout
+        self.groups = set()
+
+    def labels(self):
+        """Return the labels of the innermost stage of the calling thread."""
+        stack = getattr(self.local, "stack", None)
+        return dict(stack[-1]) if stack else {}
+
+    def record(self, name, category, start, end, labels, usage):
+        """Record an event which took place between the two times."""
+        with self.lock:
+            thread = self.threads.setdefault(
+                threading.get_ident(), len(self.threads) + 1
+            )
+            self.events.append(
+                {
+                    "name": name,
+                    "category": category,
+                    "start": start - self.origin,
+                    "wall": end - start,
+                    "thread": thread,
+                    "labels": labels,
+                    **usage,
+                }
+            )
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Measure a stage of the analysis run in the calling thread."""
+        labels = {**self.labels(), **labels}
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        self.local.stack.append(labels)
+        before = resource.getrusage(RUSAGE_THREAD)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            after = resource.getrusage(RUSAGE_THREAD)
+            self.local.stack.pop()
+            self.record(
+                name,
+                "stage",
+                start,
+                end,
+                labels,
+                {
+                    "cpu": (after.ru_utime - before.ru_utime)
+                    + (after.ru_stime - before.ru_stime),
+                    "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    * RSS_UNIT,
+                    "written": (after.ru_oublock - before.ru_oublock) * BLOCK_SIZE,
+                },
+            )
+
+    def wrap(self, name, function, **labels):
+        """Return a function running the given one as a labeled stage."""
+
+        def staged(*args, **kwargs):
+            with self.stage(name, **labels):
+                return function(*args, **kwargs)
+
+        return staged
+
+    def run(
+        self, command, stdout=None, stderr=None, check=True, timeout=None, **kwargs
+    ):
+        """
+        Run a command like subprocess.run and record its resource usage.
+        Return the standard output if it is captured using subprocess.PIPE.
+        Capturing the standard error output is not supported. If the command
+        does not finish within the timeout, it is killed together with all
+        its descendants and subprocess.TimeoutExpired is raised.
+        """
+        labels = {**self.labels(), "command": command_name(command)}
+        expired = threading.Event()
+        if timeout is not None:
+            # Run the command in a new process group to be able to kill it whole.
+            # The group stays in the session, so it still stops on Ctrl-Z.
+            kwargs["process_group"] = 0
+        start = time.perf_counter()
+        with subprocess.Popen(
+            command, stdout=stdout, stderr=stderr, **kwargs
+        ) as process:
+
+            def kill():
+                expired.set()
+                self.kill_group(process.pid)
+
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, kill)
+                with self.lock:
+                    self.groups.add(process.pid)
+                timer.start()
+            try:
+                output = process.stdout.read() if stdout == subprocess.PIPE else None
+                # Reap the process directly to obtain its resource usage
+                _, status, usage = os.wait4(process.pid, 0)
+            except KeyboardInterrupt:
+                # The group does not receive the interrupt from the terminal
+                if timer is not None:
+                    self.kill_group(process.pid)
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                    with self.lock:
+                        self.groups.discard(process.pid)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        end = time.perf_counter()
+        if expired.is_set():
+            labels["timeout"] = timeout
+        self.record(
+            command_name(command),
+            "subprocess",
+            start,
+            end,
+            labels,
+            {
+                "cpu": usage.ru_utime + usage.ru_stime,
+                "max_rss": usage.ru_maxrss * RSS_UNIT,
+                "written": usage.ru_oublock * BLOCK_SIZE,
+            },
+        )
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(command, timeout, output)
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, output)
+        return output
+
+    @staticmethod
+    def kill_group(pid):
+        """Kill a process group, unless it has already exited."""
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def kill_groups(self):
+        """
+        Kill the process groups of all running commands with a timeout, e.g.,
+        when the analysis is interrupted.
+        """
+        with self.lock:
+            groups = list(self.groups)
+        for pid in groups:
+            self.kill_group(pid)
+
+    def select(self, **labels):
+        """Return the events whose labels contain any of the given values."""
+        with self.lock:
+            events = list(self.events)
+        return [
+            event
+            for event in events
+            if all(
+                event["labels"].get(label) in values
+                for label, values in labels.items()
+            )
+        ]
+
+    @staticmethod
+    def summarize(events):
+        """Aggregate the events by their names."""
+        summary = {}
+        for event in events:
+            entry = summary.setdefault(
+                event["name"],
+                {
+                    "category": event["category"],
+                    "count": 0,
+                    "wall": 0.0,
+                    "cpu": 0.0,
+                    "max_rss": 0,
+                    "written": 0,
+                },
+            )
+            entry["count"] += 1
+            entry["wall"] += event["wall"]
+            entry["cpu"] += event["cpu"]
+            entry["max_rss"] = max(entry["max_rss"], event["max_rss"])
+            entry["written"] += event["written"]
+        return summary
+
+    @staticmethod
+    def to_trace(events):
+        """Convert events to the Chrome trace event format."""
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": event["name"],
+                    "cat": event["category"],
+                    "ph": "X",
+                    "ts": round(event["start"] * 1e6),
+                    "dur": round(event["wall"] * 1e6),
+                    "pid": 1,
+                    "tid": event["thread"],
+                    "args": {
+                        **event["labels"],
+                        "cpu": event["cpu"],
+                        "max_rss": event["max_rss"],
+                        "written": event["written"],
+                    },
+                }
+                for event in events
+            ],
+        }
+
+    def dump(self, output_dir, events):
+        """
+        Export the events with their summary and the timeline in the Chrome
+        trace format into the given directory.
+        """
+        with open(os.path.join(output_dir, PROFILE_FILENAME), "w") as profile_file:
+            json.dump(
+                {"summary": self.summarize(events), "events": events},
+                profile_file,
+                indent=1,
+            )
+        with open(os.path.join(output_dir, TRACE_FILENAME), "w") as trace_file:
+            json.dump(self.to_trace(events), trace_file)
+
+
+# The profiler shared by all stages of the analysis
+profiler = Profiler()
+# Commands with a timeout run in their own process groups, which would outlive
+# the analysis otherwise
+atexit.register(profiler.kill_groups)
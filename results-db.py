@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sys
+from compare import DiffType
+from database import ResultsDatabase
+from storage import YAML_FORMAT, find_results_file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Import results of analyze.py into an SQLite database and "
+        "query them across projects and runs."
+    )
+    parser.add_argument(
+        "--database",
+        default="results.db",
+        help="path to the SQLite database",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import",
+        help="import results of projects, replacing their previous import",
+    )
+    import_parser.add_argument(
+        "directories",
+        nargs="+",
+        help="output directories of projects or directories containing them",
+    )
+
+    query_parser = subparsers.add_parser(
+        "query", help="list results matching all given conditions"
+    )
+    query_parser.add_argument("--project", help="name of the project")
+    query_parser.add_argument("--function", help="name of the function")
+    query_parser.add_argument(
+        "--type",
+        choices=[diff_type.value for diff_type in DiffType],
+        help="kind of the result",
+    )
+    query_parser.add_argument("--category", help="category from the review")
+
+    stats_parser = subparsers.add_parser(
+        "stats", help="count results of each kind in each comparison"
+    )
+    stats_parser.add_argument("--project", help="name of the project")
+
+    sql_parser = subparsers.add_parser("sql", help="run an SQL query")
+    sql_parser.add_argument("query", help="the SQL query")
+    return parser.parse_args()
+
+
+def find_projects(directory):
+    """
+    Return pairs of a project name and its output directory for an output
+    directory of a project or a directory containing such directories.
+    """
+    directory = os.path.normpath(directory)
+    if find_results_file(directory, YAML_FORMAT) is not None:
+        return [(os.path.basename(directory), directory)]
+    return [
+        (entry.name, entry.path)
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name)
+        if entry.is_dir() and find_results_file(entry.path, YAML_FORMAT) is not None
+    ]
+
+
+def print_rows(rows):
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    database = ResultsDatabase(args.database)
+    if args.command == "import":
+        for directory in args.directories:
+            if not os.path.isdir(directory):
+                print(f"Directory {directory} does not exist.")
+                sys.exit(1)
+            for project_name, project_dir in find_projects(directory):
+                imported = database.import_project(project_name, project_dir)
+                print(f"Imported {imported} results of {project_name}.")
+    elif args.command == "query":
+        print_rows(
+            database.query(args.project, args.function, args.type, args.category)
+        )
+    elif args.command == "stats":
+        print_rows(database.get_stats(args.project))
+    elif args.command == "sql":
+        columns, rows = database.execute(args.query)
+        print_rows([columns] + rows)
+    database.close()
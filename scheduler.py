@@ -0,0 +1,155 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from instrument import profiler
+
+
+class Task:
+    """A unit of work run by the scheduler."""
+
+    def __init__(
+        self, name, description, function, args, dependencies, priority, memory
+    ):
+        self.name = name
+        self.description = description
+        self.function = function
+        self.args = args
+        self.dependencies = dependencies
+        self.priority = priority
+        self.memory = memory
+
+
+class Scheduler:
+    """
+    Class for running interdependent tasks concurrently. A task is started as
+    soon as all of its dependencies have finished successfully, while at most
+    a given number of tasks run at once and the expected memory usage of the
+    running tasks stays within the given limit. Running tasks may add new
+    tasks to the scheduler.
+    """
+
+    def __init__(self, jobs=1, memory=None):
+        self.jobs = max(jobs, 1)
+        self.memory = memory
+        self.tasks = {}
+        self.new_tasks = []
+        self.lock = threading.Lock()
+
+    def add(
+        self,
+        name,
+        description,
+        function,
+        *args,
+        dependencies=(),
+        priority=0,
+        memory=0,
+    ):
+        """
+        Add a task to the scheduler. Tasks with a lower priority value are
+        started first when several tasks are ready. Dependencies on tasks that
+        were never added are considered satisfied. The memory is the expected
+        memory usage of the task, in the same units as the scheduler limit.
+        """
+        task = Task(
+            name, description, function, args, list(dependencies), priority, memory
+        )
+        with self.lock:
+            self.tasks[name] = task
+            self.new_tasks.append(task)
+
+    def fits(self, task, running):
+        """Check whether a task can be started next to the running tasks."""
+        if len(running) >= self.jobs:
+            return False
+        if self.memory is None or not running:
+            return True
+        used = sum(running_task.memory for running_task in running.values())
+        return used + task.memory <= self.memory
+
+    def run(self):
+        """
+        Run all tasks. Return a pair of a dictionary mapping names of failed
+        tasks to the raised exceptions and a list of tasks which were not run
+        because some of their dependencies failed.
+        """
+        waiting = []
+        succeeded = set()
+        failed = {}
+        skipped = []
+        running = {}
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while True:
+                    with self.lock:
+                        waiting.extend(self.new_tasks)
+                        self.new_tasks = []
+                        total = len(self.tasks)
+                    if not waiting and not running:
+                        break
+
+                    # Drop tasks that can never run because a dependency failed
+                    blocked = [
+                        task
+                        for task in waiting
+                        if any(
+                            dep in failed or dep in skipped for dep in task.dependencies
+                        )
+                    ]
+                    for task in blocked:
+                        waiting.remove(task)
+                        skipped.append(task.name)
+                        done += 1
+                        print(f"[{done}/{total}] Skipping {task.description}.")
+                    if blocked:
+                        continue
+
+                    # Start ready tasks while there are free resources
+                    ready = sorted(
+                        (
+                            task
+                            for task in waiting
+                            if all(
+                                dep in succeeded or dep not in self.tasks
+                                for dep in task.dependencies
+                            )
+                        ),
+                        key=lambda task: task.priority,
+                    )
+                    for task in ready:
+                        if not self.fits(task, running):
+                            break
+                        waiting.remove(task)
+                        future = executor.submit(task.function, *task.args)
+                        running[future] = task
+
+                    if not running:
+                        # The remaining tasks have unsatisfiable dependencies
+                        skipped.extend(task.name for task in waiting)
+                        break
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        task = running.pop(future)
+                        done += 1
+                        try:
+                            future.result()
+                        except Exception as error:
+                            failed[task.name] = error
+                            print(
+                                f"[{done}/{total}] Failed {task.description}: "
+                                f"{error}"
+                            )
+                        else:
+                            succeeded.add(task.name)
+                            print(f"[{done}/{total}] Finished {task.description}.")
+            except KeyboardInterrupt:
+                # Commands running in their own process groups are not
+                # interrupted, and the executor would wait for them
+                for future in running:
+                    future.cancel()
+                profiler.kill_groups()
+                raise
+        return failed, skipped
@@ -0,0 +1,200 @@
+import json
+import os
+import yaml
+
+# Use the C implementation of the YAML parser and emitter if available
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+
+YAML_FORMAT = "yaml"
+JSONL_FORMAT = "jsonl"
+RESULTS_FORMATS = [YAML_FORMAT, JSONL_FORMAT]
+RESULTS_EXTENSIONS = {YAML_FORMAT: ".yml", JSONL_FORMAT: ".jsonl"}
+RESULTS_BASENAME = "results"
+
+
+def load_yaml(stream):
+    """Load a YAML document, equivalent to yaml.safe_load."""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data, stream):
+    """Dump data as a YAML document, equivalent to yaml.safe_dump."""
+    yaml.dump(data, stream, Dumper=SafeDumper)
+
+
+def get_format(path):
+    """Determine the format of a results file from its extension."""
+    if path.endswith(RESULTS_EXTENSIONS[JSONL_FORMAT]):
+        return JSONL_FORMAT
+    return YAML_FORMAT
+
+
+def get_results_file(directory, results_format):
+    """Return the path to the results file of the given format in a directory."""
+    return os.path.join(
+        directory, RESULTS_BASENAME + RESULTS_EXTENSIONS[results_format]
+    )
+
+
+def find_results_file(directory, results_format):
+    """
+    Find an existing results file in a directory, preferring the given format.
+    Return None if there are no results in any format.
+    """
+    for candidate in [results_format] + RESULTS_FORMATS:
+        path = get_results_file(directory, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def iter_yaml_results(stream):
+    """
+    Incrementally parse YAML results, yielding pairs of a key and the results
+    of one comparison at a time. The results of a comparison are a mapping of
+    function names to the kinds of the results.
+    """
+    parser = SafeLoader(stream)
+    try:
+        event = parser.get_event()
+        while not isinstance(event, yaml.MappingStartEvent):
+            if isinstance(event, yaml.StreamEndEvent):
+                return
+            event = parser.get_event()
+        while not isinstance(parser.peek_event(), yaml.MappingEndEvent):
+            key = parser.get_event().value
+            tag_results = {}
+            if isinstance(parser.peek_event(), yaml.MappingStartEvent):
+                parser.get_event()
+                while not isinstance(parser.peek_event(), yaml.MappingEndEvent):
+                    function = parser.get_event().value
+                    tag_results[function] = parser.get_event().value
+            parser.get_event()
+            yield key, tag_results
+    finally:
+        parser.dispose()
+
+
+def iter_results(path):
+    """
+    Yield pairs of a key and the results of one comparison at a time from a
+    results file in any of the supported formats.
+    """
+    with open(path, "r") as results_file:
+        if get_format(path) == JSONL_FORMAT:
+            for line in results_file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record["key"], record["results"]
+        else:
+            yield from iter_yaml_results(results_file)
+
+
+def write_results(path, items):
+    """
+    Write pairs of a key and the results of one comparison into a results
+    file, one comparison at a time. YAML output has the same layout as a
+    dumped dictionary of all results.
+    """
+    results_format = get_format(path)
+    empty = True
+    with open(path, "w") as results_file:
+        for key, tag_results in items:
+            empty = False
+            if results_format == JSONL_FORMAT:
+                record = {"key": key, "results": tag_results}
+                results_file.write(json.dumps(record) + "\n")
+            else:
+                dump_yaml({key: tag_results}, results_file)
+        if empty and results_format == YAML_FORMAT:
+            dump_yaml({}, results_file)
+
+
+class IndexedResults:
+    """
+    Random access to the results of individual comparisons in a results file
+    without loading the whole file. The file is indexed by the offsets of the
+    results of each comparison, which are parsed only when requested.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = get_format(path)
+        self.file = open(path, "rb")
+        try:
+            self.index = self.build_index()
+        except Exception:
+            self.file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the results file."""
+        self.file.close()
+
+    def parse_key(self, line):
+        """Parse the key of the comparison starting on the given line."""
+        if self.format == JSONL_FORMAT:
+            prefix = '{"key": '
+            text = line.decode()
+            if text.startswith(prefix):
+                return json.JSONDecoder().raw_decode(text, len(prefix))[0]
+            return json.loads(text)["key"]
+        # Long keys would be emitted in the complex form starting with "? "
+        mapping = None if line.startswith(b"?") else load_yaml(line)
+        if not isinstance(mapping, dict) or len(mapping) != 1:
+            raise ValueError(
+                f"Unexpected line in results file {self.path}: {line.decode()!r}"
+            )
+        return next(iter(mapping))
+
+    def starts_comparison(self, line):
+        """Check whether a line starts the results of a comparison."""
+        if self.format == JSONL_FORMAT:
+            return bool(line.strip())
+        # In YAML, comparisons are the only keys which are not indented, files
+        # without any comparisons contain an empty mapping
+        if line.startswith(b"...") or line.rstrip() == b"{}":
+            return False
+        return line[:1] not in b" \t#-\r\n"
+
+    def build_index(self):
+        """Map the keys of all comparisons to their spans in the file."""
+        index = {}
+        key = None
+        start = offset = 0
+        for line in self.file:
+            if self.starts_comparison(line):
+                if key is not None:
+                    index[key] = (start, offset)
+                key = self.parse_key(line)
+                start = offset
+            offset += len(line)
+        if key is not None:
+            index[key] = (start, offset)
+        return index
+
+    def keys(self):
+        """Return the keys of all comparisons in the order of the file."""
+        return list(self.index)
+
+    def get(self, key):
+        """Load the results of a comparison, return None if it is missing."""
+        if key not in self.index:
+            return None
+        start, end = self.index[key]
+        self.file.seek(start)
+        text = self.file.read(end - start).decode()
+        if self.format == JSONL_FORMAT:
+            return json.loads(text)["results"]
+        for _, tag_results in iter_yaml_results(text):
+            return tag_results
@@ -1,9 +1,11 @@
 #!/usr/bin/python3
 
 import argparse
-import yaml
 import enum
-from compare import ComparisonResults, DiffType
+from collections import Counter
+from columnar import ColumnarResults
+from compare import DiffType
+from storage import dump_yaml, load_yaml
 
 CATEGORY_KEY = "category"
 
@@ -48,119 +50,72 @@ def parse_args():
 if __name__ == "__main__":
     args = parse_args()
 
-    original_stats = ComparisonResults.load(args.original_results).get_stats()
+    original_results = ColumnarResults.load(args.original_results)
+    original_stats = original_results.get_stats()
 
     with open(args.semantic_review, "r") as f:
-        semantic_review = yaml.safe_load(f)
+        semantic_review = load_yaml(f)
 
     with open(args.syntactic_review, "r") as f:
-        syntactic_review = yaml.safe_load(f)
-
-    summary = {
-        tag_key: {
-            DiffType.SEMANTIC.value: {},
-            DiffType.SYNTACTIC.value: {},
-        }
-        for tag_key in original_stats.keys()
-    }
+        syntactic_review = load_yaml(f)
 
+    summary = {}
+    semantic_totals = Counter()
+    syntactic_totals = Counter()
     for tag_key, tag_stats in original_stats.items():
-        summary[tag_key][DiffType.NO_DIFF.value] = original_stats[tag_key][
-            DiffType.NO_DIFF.value
-        ]
-        summary[tag_key][DiffType.UNKNOWN.value] = original_stats[tag_key][
-            DiffType.UNKNOWN.value
-        ]
-        semantic_results = [
-            semantic_review[tag_key][function][CATEGORY_KEY]
-            for function in semantic_review[tag_key].keys()
-        ]
-        if not all(
-            [
-                x in [sem_result.value for sem_result in SemResult]
-                for x in semantic_results
-            ]
-        ):
+        semantic_counts = Counter(
+            review[CATEGORY_KEY] for review in semantic_review[tag_key].values()
+        )
+        if not set(semantic_counts) <= {sem_result.value for sem_result in SemResult}:
             print(f"WARNING: Unknown semantic review type in {tag_key}.")
-        for semantic_review_type in SemResult:
-            summary[tag_key][DiffType.SEMANTIC.value][semantic_review_type.value] = len(
-                [x for x in semantic_results if x == semantic_review_type.value]
-            )
         if syntactic_review is None or tag_key not in syntactic_review:
-            summary[tag_key][DiffType.SYNTACTIC.value] = {
-                SynResult.TRIVIAL.value: 0,
-                SynResult.WRONG.value: 0,
-                SynResult.NON_TRIVIAL.value: original_stats[tag_key][
-                    DiffType.SYNTACTIC.value
-                ],
-            }
-            continue
-        syntactic_results = [
-            syntactic_review[tag_key][function][CATEGORY_KEY]
-            for function in syntactic_review[tag_key].keys()
-        ]
-        if not all(
-            [
-                x in [syn_result.value for syn_result in SynResult]
-                for x in syntactic_results
-            ]
-        ):
-            print(f"WARNING: Unknown syntactic review type in {tag_key}.")
-        summary[tag_key][DiffType.SYNTACTIC.value][SynResult.TRIVIAL.value] = len(
-            [x for x in syntactic_results if x == SynResult.TRIVIAL.value]
-        )
-        summary[tag_key][DiffType.SYNTACTIC.value][SynResult.WRONG.value] = len(
-            [x for x in syntactic_results if x == SynResult.WRONG.value]
-        )
-        summary[tag_key][DiffType.SYNTACTIC.value][SynResult.NON_TRIVIAL.value] = (
-            original_stats[tag_key][DiffType.SYNTACTIC.value]
-            - summary[tag_key][DiffType.SYNTACTIC.value][SynResult.TRIVIAL.value]
-            - summary[tag_key][DiffType.SYNTACTIC.value][SynResult.WRONG.value]
+            syntactic_counts = Counter()
+        else:
+            syntactic_counts = Counter(
+                review[CATEGORY_KEY] for review in syntactic_review[tag_key].values()
+            )
+            if not set(syntactic_counts) <= {
+                syn_result.value for syn_result in SynResult
+            }:
+                print(f"WARNING: Unknown syntactic review type in {tag_key}.")
+        syntactic_counts[SynResult.NON_TRIVIAL.value] = (
+            tag_stats[DiffType.SYNTACTIC.value]
+            - syntactic_counts[SynResult.TRIVIAL.value]
+            - syntactic_counts[SynResult.WRONG.value]
         )
 
+        summary[tag_key] = {
+            DiffType.NO_DIFF.value: tag_stats[DiffType.NO_DIFF.value],
+            DiffType.UNKNOWN.value: tag_stats[DiffType.UNKNOWN.value],
+            DiffType.TIMEOUT.value: tag_stats[DiffType.TIMEOUT.value],
+            DiffType.SEMANTIC.value: {
+                review_type.value: semantic_counts[review_type.value]
+                for review_type in SemResult
+            },
+            DiffType.SYNTACTIC.value: {
+                review_type.value: syntactic_counts[review_type.value]
+                for review_type in SynResult
+            },
+        }
+        semantic_totals.update(summary[tag_key][DiffType.SEMANTIC.value])
+        syntactic_totals.update(summary[tag_key][DiffType.SYNTACTIC.value])
+
+    totals = original_results.get_totals()
     summary["total"] = {
-        DiffType.SEMANTIC.value: {},
-        DiffType.SYNTACTIC.value: {},
-        DiffType.NO_DIFF.value: sum(
-            [
-                summary[tag_key][DiffType.NO_DIFF.value]
-                for tag_key in original_stats.keys()
-            ]
-        ),
-        DiffType.UNKNOWN.value: sum(
-            [
-                summary[tag_key][DiffType.UNKNOWN.value]
-                for tag_key in original_stats.keys()
-            ]
-        ),
-    }
-    for review_type in SemResult:
-        summary["total"][DiffType.SEMANTIC.value][review_type.value] = sum(
-            [
-                summary[tag_key][DiffType.SEMANTIC.value][review_type.value]
-                for tag_key in original_stats.keys()
-            ]
-        )
-    summary["total"][DiffType.SEMANTIC.value]["total"] = sum(
-        [
-            summary["total"][DiffType.SEMANTIC.value][review_type.value]
+        DiffType.NO_DIFF.value: totals[DiffType.NO_DIFF.value],
+        DiffType.UNKNOWN.value: totals[DiffType.UNKNOWN.value],
+        DiffType.TIMEOUT.value: totals[DiffType.TIMEOUT.value],
+        DiffType.SEMANTIC.value: {
+            review_type.value: semantic_totals[review_type.value]
             for review_type in SemResult
-        ]
-    )
-
-    for review_type in SynResult:
-        summary["total"][DiffType.SYNTACTIC.value][review_type.value] = sum(
-            [
-                summary[tag_key][DiffType.SYNTACTIC.value][review_type.value]
-                for tag_key in original_stats.keys()
-            ]
-        )
-    summary["total"][DiffType.SYNTACTIC.value]["total"] = sum(
-        [
-            summary["total"][DiffType.SYNTACTIC.value][review_type.value]
+        },
+        DiffType.SYNTACTIC.value: {
+            review_type.value: syntactic_totals[review_type.value]
             for review_type in SynResult
-        ]
-    )
+        },
+    }
+    summary["total"][DiffType.SEMANTIC.value]["total"] = semantic_totals.total()
+    summary["total"][DiffType.SYNTACTIC.value]["total"] = syntactic_totals.total()
 
     with open(args.output, "w") as output:
-        yaml.safe_dump(summary, output)
+        dump_yaml(summary, output)
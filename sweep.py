@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+import argparse
+import copy
+import os
+import re
+import sys
+import tempfile
+from collections import Counter
+from analyze import (
+    SWEEP_DIRNAME,
+    Analysis,
+    add_options,
+    create_cache,
+    enforce_disk_quota,
+)
+from compare import ComparisonResults, DiffType
+from scheduler import Scheduler
+from storage import dump_yaml, load_yaml
+
+SWEEP_FILENAME = "sweep.yml"
+CONFIGURATION_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def parse_args():
+    """Prepare the parser of command-line arguments and parse them."""
+    parser = argparse.ArgumentParser(
+        description="Compare multiple versions of a C project using Diffkemp "
+        "with multiple pattern configurations, sharing the built snapshots."
+    )
+    parser.add_argument(
+        "config",
+        help="path to the configuration file, see README.md for details",
+    )
+    parser.add_argument(
+        "sweep",
+        help="path to the YAML list of pattern configurations, the first one "
+        "is the baseline, see README.md for details",
+    )
+    add_options(parser)
+    return parser.parse_args()
+
+
+def get_disabled(configuration):
+    """Return the list of built-in patterns disabled by a configuration."""
+    disabled = configuration.get("disable-patterns") or []
+    if isinstance(disabled, str):
+        disabled = disabled.split(",")
+    return sorted(pattern.strip() for pattern in disabled)
+
+
+def load_configurations(sweep_file):
+    """Load and check the list of pattern configurations."""
+    with open(sweep_file, "r") as s_file:
+        configurations = load_yaml(s_file)
+    if not configurations or not isinstance(configurations, list):
+        raise ValueError(f"{sweep_file} does not contain a list of configurations")
+    names = set()
+    for configuration in configurations:
+        name = str(configuration.get("name", ""))
+        if not CONFIGURATION_NAME.match(name):
+            raise ValueError(f"Invalid name of a configuration: '{name}'")
+        if name in names:
+            raise ValueError(f"Duplicate name of a configuration: '{name}'")
+        names.add(name)
+    return configurations
+
+
+def compare_results(baseline, results):
+    """Count the changes of classifications from the baseline results."""
+    changes = Counter()
+    for key, baseline_results in baseline.results.items():
+        tag_results = results.results.get(key, {})
+        for function, result in baseline_results.items():
+            other = tag_results.get(function, result)
+            if other != result:
+                changes[f"{result} -> {other}"] += 1
+    return changes
+
+
+def get_impact(configurations, analyses):
+    """
+    Compute the impact table: the number of results of each kind for each
+    configuration together with the changes from the baseline. The impact of
+    a single pattern is the change caused by a configuration which disables
+    exactly that pattern on top of the baseline.
+    """
+    baseline_config = configurations[0]
+    baseline = None
+    table = {"configurations": {}, "patterns": {}}
+    for configuration, analysis in zip(configurations, analyses):
+        results = ComparisonResults.load(analysis.results_file_path)
+        if baseline is None:
+            baseline = results
+        totals = Counter()
+        for tag_stats in results.get_stats().values():
+            totals.update(tag_stats)
+        changes = compare_results(baseline, results)
+        table["configurations"][analysis.variant] = {
+            "disable-patterns": get_disabled(configuration),
+            "custom-patterns": configuration.get("custom-patterns"),
+            "results": {
+                diff_type.value: totals[diff_type.value] for diff_type in DiffType
+            },
+            "changed": changes.total(),
+            "changes": dict(changes),
+        }
+
+        added = set(get_disabled(configuration)) - set(get_disabled(baseline_config))
+        if len(added) == 1 and configuration.get(
+            "custom-patterns"
+        ) == baseline_config.get("custom-patterns"):
+            table["patterns"][added.pop()] = {
+                "configuration": analysis.variant,
+                "changed": changes.total(),
+                "changes": dict(changes),
+            }
+    return table
+
+
+def print_impact(table):
+    """Print the per-configuration part of the impact table."""
+    kinds = [diff_type.value for diff_type in DiffType]
+    print(f"{'configuration':>24} {'changed':>8} " + " ".join(f"{k:>9}" for k in kinds))
+    for name, row in table["configurations"].items():
+        counts = " ".join(f"{row['results'][k]:>9}" for k in kinds)
+        print(f"{name:>24} {row['changed']:>8} {counts}")
+
+
+def main():
+    args = parse_args()
+
+    with open(args.config, "r") as config_file:
+        config = load_yaml(config_file)
+    configurations = load_configurations(args.sweep)
+
+    cache = create_cache(args)
+    # The snapshots are built once and shared by all configurations
+    build_args = copy.copy(args)
+    build_args.no_compare = True
+    builds = Analysis(build_args, config, cache)
+    analyses = []
+    for configuration in configurations:
+        variant_args = copy.copy(args)
+        variant_args.disable_patterns = ",".join(get_disabled(configuration))
+        variant_args.custom_patterns = configuration.get("custom-patterns")
+        analyses.append(
+            Analysis(variant_args, config, cache, variant=str(configuration["name"]))
+        )
+
+    builds.clone()
+    builds.prepare()
+    for analysis in analyses:
+        analysis.prepare()
+
+    scheduler = Scheduler(args.jobs, args.memory)
+    with tempfile.TemporaryDirectory(prefix="diffkemp-analysis-") as run_dir:
+        builds.schedule(scheduler, run_dir)
+        if not args.no_compare:
+            for analysis in analyses:
+                if analysis.compare:
+                    analysis.schedule_comparisons(scheduler)
+        failed, skipped = scheduler.run()
+    cache.evict(keep=builds.keys)
+    enforce_disk_quota(args, cache, keep=builds.keys)
+
+    for name, error in failed.items():
+        if name[1] == "build":
+            print(f"Failed {scheduler.tasks[name].description}: {error}")
+    if args.no_compare:
+        return 1 if failed else 0
+    status = [analysis.finish(failed, skipped) for analysis in analyses]
+    if any(status):
+        return 1
+
+    table = get_impact(configurations, analyses)
+    sweep_file_path = os.path.join(
+        args.output, builds.project_name, SWEEP_DIRNAME, SWEEP_FILENAME
+    )
+    print(f"Exporting impact of the configurations to {sweep_file_path}.")
+    with open(sweep_file_path, "w") as sweep_file:
+        dump_yaml(table, sweep_file)
+    print_impact(table)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+; ModuleID = 'a.c'
+source_filename = "a.c"
+
+@.str = private unnamed_addr constant [6 x i8] c"a.c:\0A\00", align 1
+@counter = dso_local global i32 0, align 4
+
+define dso_local i32 @foo() #0 {
+  %1 = call i32 (ptr, ...) @printf(ptr noundef @.str)
+  %2 = call i32 @bar()
+  ret i32 %2
+}
+
+define dso_local i32 @qux() #0 {
+  %1 = call i32 (ptr, ...) @printf(ptr noundef @.str)
+  %2 = call i32 @helper()
+  ret i32 %2
+}
+
+define internal i32 @helper() #0 {
+  %1 = load i32, ptr @counter, align 4
+  ret i32 %1
+}
+
+declare i32 @printf(ptr noundef, ...) #1
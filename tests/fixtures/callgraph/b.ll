@@ -0,0 +1,22 @@
+; ModuleID = 'sub/b.c'
+source_filename = "sub/b.c"
+
+@.str = private unnamed_addr constant [6 x i8] c"b.c:\0A\00", align 1
+
+define dso_local i32 @bar() #0 {
+  %1 = call i32 @helper()
+  ret i32 %1
+}
+
+define dso_local i32 @baz() #0 {
+  %1 = call i32 (ptr, ...) @printf(ptr noundef @.str)
+  ret i32 0
+}
+
+define internal i32 @helper() #0 {
+  ret i32 0
+}
+
+declare i32 @printf(ptr noundef, ...) #1
+
+!0 = !DIFile(filename: "b.c", directory: "/build/sub")
@@ -0,0 +1,95 @@
+import subprocess
+import pytest
+from blame import LOG_ENGINE, CommitCache, CommitLinkFinder, HunkCommitFinder
+from git import Repo
+
+
+FUNCTION = "int f()\n{\n    return 1;\n}\n"
+GLOBALS = "".join(f"int x{i};\n" for i in range(20))
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """Create an empty repository with a committed file defining f."""
+    def git(*args):
+        return (
+            subprocess.check_output(["git", *args], cwd=tmp_path).decode().strip()
+        )
+
+    git("init", "-q", "-b", "main")
+    git("config", "user.name", "Test")
+    git("config", "user.email", "test@example.com")
+    (tmp_path / "a.c").write_text(FUNCTION)
+    git("add", "a.c")
+    git("commit", "-q", "-m", "Add f")
+    git("tag", "v1")
+    return tmp_path, git
+
+
+def commit(path, git, content, message):
+    """Commit new contents of a.c and return the SHA of the commit."""
+    (path / "a.c").write_text(content)
+    git("commit", "-q", "-a", "-m", message)
+    return git("rev-parse", "HEAD")
+
+
+def test_linear_history(repo):
+    path, git = repo
+    changed = commit(path, git, FUNCTION.replace("1", "2"), "Change f")
+    commit(path, git, GLOBALS + FUNCTION.replace("1", "2"), "Add globals")
+    git("tag", "v2")
+
+    finder = HunkCommitFinder(Repo(path), "v1", "v2")
+    assert finder.find({("f", "a.c"): 21}) == {("f", "a.c"): [changed]}
+
+
+def test_merge(repo):
+    path, git = repo
+    git("checkout", "-q", "-b", "side")
+    changed = commit(path, git, FUNCTION.replace("1", "2"), "Change f")
+    git("checkout", "-q", "main")
+    commit(path, git, GLOBALS + FUNCTION, "Add globals")
+    git("merge", "-q", "--no-edit", "side")
+    git("tag", "v2")
+
+    finder = HunkCommitFinder(Repo(path), "v1", "v2")
+    assert finder.find({("f", "a.c"): 21}) == {("f", "a.c"): [changed]}
+
+
+def test_merge_resolving_conflict(repo):
+    path, git = repo
+    git("checkout", "-q", "-b", "side")
+    commit(path, git, FUNCTION.replace("1", "2"), "Return 2")
+    git("checkout", "-q", "main")
+    commit(path, git, FUNCTION.replace("1", "3"), "Return 3")
+    # The merge conflicts, so it is committed after resolving the conflict
+    subprocess.call(
+        ["git", "merge", "-q", "side"],
+        cwd=path,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    merge = commit(path, git, FUNCTION.replace("1", "4"), "Merge side")
+    git("tag", "v2")
+
+    finder = HunkCommitFinder(Repo(path), "v1", "v2")
+    commits = finder.find({("f", "a.c"): 1})[("f", "a.c")]
+    assert commits[0] == merge
+    assert len(commits) == 3
+
+
+def test_commit_cache(repo):
+    path, git = repo
+    git("remote", "add", "origin", "https://example.com/project.git")
+    changed = commit(path, git, FUNCTION.replace("1", "2"), "Change f")
+    git("tag", "v2")
+    old, new = git("rev-parse", "v1"), git("rev-parse", "v2")
+
+    cache = CommitCache()
+    diffkemp_out = {"results": [], "definitions": {}}
+    finder = CommitLinkFinder(path, "v1", "v2", diffkemp_out, cache)
+    assert finder.lookup_commits("f", "a.c") == [changed]
+    assert finder.lookup_commits("f", "missing.c") == []
+    # Failed lookups are not cached and the keys do not depend on the tags
+    key = CommitCache.key("f", "a.c", old, new, LOG_ENGINE)
+    assert cache.commits == {key: [changed]}
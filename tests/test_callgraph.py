@@ -0,0 +1,27 @@
+import os
+import pytest
+from callgraph import CallGraph
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "callgraph")
+
+
+@pytest.fixture
+def call_graph():
+    return CallGraph.load(FIXTURES_DIR)
+
+
+def test_string_literals_stay_in_their_module(call_graph):
+    assert call_graph.source_files("baz") == {"sub/b.c", "/build/sub/b.c"}
+
+
+def test_static_functions_stay_in_their_module(call_graph):
+    assert call_graph.source_files("qux") == {"a.c"}
+
+
+def test_external_callees(call_graph):
+    assert call_graph.source_files("foo") == {"a.c", "sub/b.c", "/build/sub/b.c"}
+
+
+def test_unknown_function(call_graph):
+    assert call_graph.source_files("printf") is None
@@ -0,0 +1,29 @@
+import pytest
+from storage import IndexedResults, write_results
+
+
+@pytest.mark.parametrize("name", ["results.yml", "results.jsonl"])
+def test_empty_results(tmp_path, name):
+    path = str(tmp_path / name)
+    write_results(path, [])
+    with IndexedResults(path) as results:
+        assert results.keys() == []
+        assert results.get("v1-v2") is None
+
+
+@pytest.mark.parametrize("name", ["results.yml", "results.jsonl"])
+def test_indexed_results(tmp_path, name):
+    path = str(tmp_path / name)
+    items = [("v1-v2", {"f": "equal", "g": "not-equal"}), ("v2-v3", {})]
+    write_results(path, items)
+    with IndexedResults(path) as results:
+        assert results.keys() == ["v1-v2", "v2-v3"]
+        assert results.get("v1-v2") == {"f": "equal", "g": "not-equal"}
+        assert results.get("v2-v3") == {}
+
+
+def test_complex_key_rejected(tmp_path):
+    path = tmp_path / "results.yml"
+    path.write_text("? v1-v2\n: {}\n")
+    with pytest.raises(ValueError):
+        IndexedResults(str(path))